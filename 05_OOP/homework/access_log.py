@@ -0,0 +1,100 @@
+""" Журнал обращений к сервису в виде строк JSON.
+Обработчик запроса только кладет запись в очередь, форматирование
+и запись в файл выполняет поток QueueListener """
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+LOGGING_FORMAT = "[%(asctime)s] %(levelname).1s %(message)s"
+LOGGING_DATEFMT = "%Y.%m.%d %H:%M:%S"
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """ Передает записи в очередь без форматирования,
+    сообщение формирует поток QueueListener """
+
+    def prepare(self, record):
+        return record
+
+
+def start_listener(logger: logging.Logger, handler: logging.Handler,
+                   level=logging.INFO) -> logging.handlers.QueueListener:
+    """ Подключение к логгеру очереди, которую разбирает отдельный поток """
+    records = queue.SimpleQueue()
+    logger.setLevel(level)
+    logger.addHandler(AsyncQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    return listener
+
+
+def setup_logging(filename=None, level=logging.INFO) -> logging.handlers.QueueListener:
+    """ Логирование через очередь: обработчики запросов только кладут запись
+    в очередь, форматирование и запись в файл выполняет отдельный поток """
+    target = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    target.setFormatter(logging.Formatter(LOGGING_FORMAT, LOGGING_DATEFMT))
+    return start_listener(logging.getLogger(), target, level)
+
+
+class JSONLineFormatter(logging.Formatter):
+    """ Запись журнала - компактная строка JSON с полями из record.access.
+    bytes тел запроса и ответа выводятся текстом, прочие объекты - строкой """
+
+    @staticmethod
+    def text(obj) -> str:
+        """ Значение, которое json не умеет сериализовать сам """
+        if isinstance(obj, (bytes, bytearray)):
+            return obj.decode("utf-8", "replace")
+        return str(obj)
+
+    def format(self, record):
+        entry = {"time": round(record.created, 3), **record.access}
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=self.text)
+
+
+class AccessLog:
+    """ Журнал обращений api.py: файл filename или stdout.
+    sample_rate - доля успешных обращений, попадающих в журнал,
+    ответы с кодом от 400 записываются всегда.
+    Тела запросов и ответов записываются только при debug = True """
+
+    def __init__(self, filename=None, sample_rate=1.0, debug=False, name="access"):
+        self._listener = None  # поток записи, пока он не запущен - записи отбрасываются
+        self.logger = logging.getLogger(name)
+        self.logger.propagate = False  # записи обращений не попадают в журнал сервиса
+        self.filename, self.sample_rate, self.debug = filename, sample_rate, debug
+
+    def start(self):
+        """ Запуск потока записи журнала """
+        handler = logging.FileHandler(self.filename) if self.filename else \
+            logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JSONLineFormatter())
+        self._listener = start_listener(self.logger, handler)
+        return self
+
+    def stop(self):
+        """ Запись оставшихся записей, остановка потока и закрытие файла """
+        listener, self._listener = self._listener, None
+        if listener is None:
+            return
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        self.logger.handlers.clear()
+
+    def sampled(self, status: int) -> bool:
+        """ Обращение попадает в журнал """
+        return status >= 400 or self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def log(self, status: int, payload=None, **fields):
+        """ Запись об обращении: код ответа и поля вроде method, path, duration_ms.
+        payload (тела запроса и ответа) попадает в журнал только в режиме debug """
+        if self._listener is None or not self.sampled(status):
+            return
+        if self.debug and payload is not None:
+            fields["payload"] = payload
+        self.logger.info("", extra={"access": dict(fields, status=status)})
@@ -6,18 +6,25 @@
 """
 
 import argparse
-import json
 import datetime
 import logging
 import hashlib
 import re
+import threading
+import time
 import typing
 import uuid
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
 
-from scoring import get_score, get_interests
-from store import KVStore
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from access_log import AccessLog, setup_logging
+from local_store import MemoryStore, SQLiteStore
+from metrics import REGISTRY, REQUEST_LATENCY, REQUESTS
+from scoring import INTERESTS_BATCHER, get_interests_many, get_score, get_scores
+from serializers import SERIALIZERS, get_serializer
+from store import KVStore, PoolTimeoutError, Store, deadline, parse_hosts
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -28,16 +35,20 @@ FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
 }
 UNKNOWN = 0
 MALE = 1
 FEMALE = 2
+MAX_BATCH_SIZE = 1000
+METHODS = ("online_score", "online_score_batch", "clients_interests")
 GENDERS = {
     UNKNOWN: "unknown",
     MALE: "male",
@@ -47,9 +58,131 @@ GENDERS = {
 # pylint: disable=too-few-public-methods
 
 
+class AuthCache:
+    """ Кеш успешных проверок токенов по (account, login, token).
+    Токен админа зависит от даты, поэтому его дайджест считается раз в сутки,
+    а при смене суток кеш очищается """
+
+    def __init__(self, maxsize: int = 10000):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._verified: OrderedDict = OrderedDict()
+        self._admin_digest = ""
+        self._next_day = 0.0  # момент начала следующих суток (локальное время)
+
+    @staticmethod
+    def digest(data: str) -> str:
+        """ Дайджест для сравнения с токеном """
+        return hashlib.sha512(data.encode()).hexdigest()
+
+    def _refresh(self, now: float):
+        """ Смена суток: новый дайджест админа и очистка кеша """
+        today = datetime.date.fromtimestamp(now)
+        tomorrow = datetime.datetime.combine(today + datetime.timedelta(days=1),
+                                             datetime.time())
+        self._next_day = tomorrow.timestamp()
+        self._admin_digest = self.digest(today.strftime("%Y%m%d") + ADMIN_SALT)
+        self._verified.clear()
+
+    def check(self, account, login, token, is_admin: bool) -> bool:
+        """ Проверка токена, успешный результат запоминается """
+        key = (account, login, token)
+        with self._lock:
+            now = time.time()
+            if now >= self._next_day:
+                self._refresh(now)
+            if key in self._verified:
+                self._verified.move_to_end(key)
+                return True
+            admin_digest, day_end = self._admin_digest, self._next_day
+        if is_admin:
+            valid = admin_digest == token
+        else:
+            valid = self.digest(account + login + SALT) == token
+        if valid and self._maxsize > 0:
+            with self._lock:
+                if day_end != self._next_day:
+                    return valid  # сутки сменились во время проверки
+                self._verified[key] = True
+                if len(self._verified) > self._maxsize:
+                    self._verified.popitem(last=False)
+        return valid
+
+    def clear(self):
+        """ Принудительная очистка, в том числе дайджеста админа """
+        with self._lock:
+            self._next_day = 0.0
+            self._verified.clear()
+
+
+AUTH_CACHE = AuthCache()
+
+
+class AdmissionControl:
+    """ Ограничение числа одновременно обрабатываемых запросов.
+    Сверх max_inflight запрос ждет в очереди не дольше queue_timeout секунд,
+    при заполненной очереди (max_queue ожидающих) отклоняется сразу.
+    max_inflight = 0 - без ограничения """
+
+    def __init__(self, max_inflight=0, max_queue=0, queue_timeout=0.1):
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.configure(max_inflight, max_queue, queue_timeout)
+
+    def configure(self, max_inflight, max_queue, queue_timeout):
+        """ Установка ограничений, вызывается до начала обработки запросов """
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+
+    def acquire(self) -> bool:
+        """ Разрешение на обработку запроса, False если запрос отклонен """
+        # слот занимается здесь, а освобождается в release после ответа
+        # pylint: disable=consider-using-with
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+            admitted = self._slots.acquire(timeout=self.queue_timeout)
+            with self._lock:
+                self.waiting -= 1
+                if not admitted:
+                    self.rejected += 1
+                    return False
+        with self._lock:
+            self.inflight += 1
+        return True
+
+    def release(self):
+        """ Обработка запроса завершена """
+        with self._lock:
+            self.inflight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+
+ADMISSION = AdmissionControl()
+REGISTRY.callback("scoring_inflight_requests", "Requests being processed",
+                  "gauge", lambda: ADMISSION.inflight)
+REGISTRY.callback("scoring_queued_requests", "Requests waiting for admission",
+                  "gauge", lambda: ADMISSION.waiting)
+REGISTRY.callback("scoring_rejected_requests_total", "Requests rejected by admission control",
+                  "counter", lambda: ADMISSION.rejected)
+
+
 class BaseField:
     """Базовый класс, реализующий проверки для разных типов полей """
     __template__ = None
+    _pattern = None  # скомпилированный __template__
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.__template__ is not None:
+            cls._pattern = re.compile(cls.__template__)
 
     def __init__(self, required: bool = False, nullable: bool = True):
         self.required = required
@@ -60,8 +193,8 @@ class BaseField:
         if not value and not self.nullable:
             raise ValueError(f"Not nullable field {self.__class__.__name__} is empty!")
 
-        if self.__template__ and value:
-            if not re.match(self.__template__, str(value)):
+        if self._pattern is not None and value:
+            if not self._pattern.match(str(value)):
                 raise ValueError(f"Invalid value format {self.__class__.__name__}")
 
         return value
@@ -92,12 +225,18 @@ class PhoneField(CharField):
 
 class DateField(BaseField):
     """ Проверяет поле, в котором содержится дата """
+    _date_pattern = re.compile(r"^(\d{1,2})\.(\d{1,2})\.(\d{4})$")
 
     def validate(self, value):
         super().validate(value)
         if value:
             try:
-                value = datetime.datetime.strptime(value, "%d.%m.%Y")
+                # то же, что strptime(value, "%d.%m.%Y"), но без разбора формата
+                match = self._date_pattern.match(value)
+                if match is None:
+                    raise ValueError(value)
+                day, month, year = match.groups()
+                value = datetime.datetime(int(year), int(month), int(day))
             except ValueError as exc:
                 raise ValueError(f"Invalid date value in "
                                  f"{self.__class__.__name__}, 'dd.mm.yyyy' expected") from exc
@@ -160,35 +299,80 @@ class ArgumentsField(BaseField):
         return value
 
 
-class BaseRequest:
+class BatchItemsField(BaseField):
+    """ Массив словарей с аргументами, не больше MAX_BATCH_SIZE элементов """
+
+    def validate(self, value):
+        super().validate(value)
+        if not isinstance(value, list):
+            raise ValueError(f"A list of objects expected, got {value}")
+        if len(value) > MAX_BATCH_SIZE:
+            raise ValueError(f"Too many items in batch, {MAX_BATCH_SIZE} allowed")
+        return value
+
+
+class RequestMeta(type):
+    """ Метакласс запросов.
+    При создании класса собирает его поля в _fields, заменяет их слотами
+    и строит функцию валидации, заполняющую слоты экземпляра """
+
+    def __new__(mcs, name, bases, namespace):
+        fields = {}
+        for base in reversed(bases):
+            fields.update(getattr(base, "_fields", {}))
+        own_fields = {key: value for key, value in namespace.items()
+                      if isinstance(value, BaseField)}
+        for key in own_fields:
+            del namespace[key]
+        fields.update(own_fields)
+        namespace["_fields"] = fields
+        namespace["__slots__"] = tuple(own_fields)
+        cls = super().__new__(mcs, name, bases, namespace)
+        cls._validate = cls.build_validator()
+        return cls
+
+    def build_validator(cls):
+        """ Функция валидации словаря аргументов для класса запроса """
+        name = cls.__name__
+        steps = tuple((key, field.validate, field.required, getattr(cls, key).__set__)
+                      for key, field in cls._fields.items())
+
+        def validate(instance, src_dict: dict):
+            for key, validate_field, required, set_value in steps:
+                if key in src_dict:
+                    set_value(instance, validate_field(src_dict[key]))
+                elif required:
+                    raise ValueError(f"Required field {key} not found in {name}")
+                else:
+                    set_value(instance, None)
+
+        return validate
+
+
+class BaseRequest(metaclass=RequestMeta):
     """ Вызов проверки и Заполнение аргументов базового запроса к серверу """
+    _fields: typing.Dict[str, BaseField] = {}
+    _validate: typing.Callable[["BaseRequest", dict], None]  # строится метаклассом
+
     def __init__(self, src_dict: dict):
         if not isinstance(src_dict, dict):
             raise ValueError("A Dict expected in " + self.__class__.__name__)
-
-        class_fields = self.__class__.__dict__
-        for key, field in class_fields.items():
-
-            if isinstance(field, BaseField):
-                # поля запросов сохраняются в словаре экземпляра этого класса
-                if key not in src_dict:
-                    if field.required:
-                        raise ValueError(f"Required field {key} not found in "
-                                         f"{self.__class__.__name__}")
-                    self.__dict__[key] = None
-                else:
-                    self.__dict__[key] = self.__class__.__dict__[key].validate(src_dict[key])
+        # поля запросов сохраняются в слотах экземпляра этого класса
+        self._validate(src_dict)
 
     def __repr__(self) -> str:
-        attrs_list: list[str] = [f"{key}: {value}" for key, value in self.__dict__.items()]
+        attrs_list: list[str] = [f"{key}: {value}" for key, value in self.to_dict().items()]
         attrs: str = ", ".join(attrs_list)
         return f"{self.__class__.__name__}({attrs})"
 
+    def to_dict(self) -> dict:
+        """ Значения полей запроса """
+        return {key: getattr(self, key) for key in self._fields}
+
     @property
     def non_empty_fields_lst(self) -> typing.List[str]:
         """ Список непустых полей объекта """
-        # print("non_empty_fields_lst", self.__dict__)
-        return [key for key, value in self.__dict__.items() if value]
+        return [key for key in self._fields if getattr(self, key)]
 
 
 class ClientsInterestsRequest(BaseRequest):
@@ -219,6 +403,11 @@ class OnlineScoreRequest(BaseRequest):
         return False
 
 
+class OnlineScoreBatchRequest(BaseRequest):
+    """ Аргументы метода online_score_batch """
+    items = BatchItemsField(required=True, nullable=False)
+
+
 class MethodRequest(BaseRequest):
     """ Основной запрос метода """
     account = CharField(required=False, nullable=True)
@@ -234,35 +423,55 @@ class MethodRequest(BaseRequest):
 
     def check_auth(self):
         """ Аутентификация """
-
-        if self.is_admin:
-            digest_data = datetime.datetime.now().strftime("%Y%m%d") + ADMIN_SALT
-        else:
-            digest_data = self.account + self.login + SALT
-        digest = hashlib.sha512(digest_data.encode()).hexdigest()
-        if digest == self.token:
-            return True
-        return False
+        return AUTH_CACHE.check(self.account, self.login, self.token, self.is_admin)
 
     # pylint: disable=not-an-iterable
     def get_response_by_method(self, context, store) -> dict:
         """ Вызов одного из методов скоринга """
-        print("store", store)
         if self.method == "online_score":
             online_score = OnlineScoreRequest(src_dict=self.arguments)
             if not online_score.is_valid():
                 raise ValueError("Invalid online_score request arguments")
-            score = 42 if self.is_admin else get_score(**online_score.__dict__, store=store)
+            score = 42 if self.is_admin else get_score(**online_score.to_dict(), store=store)
             context["has"] = online_score.non_empty_fields_lst
             return {"score": score}
 
+        if self.method == "online_score_batch":
+            return self.get_batch_response(context, store)
+
         if self.method == "clients_interests":
             interests = ClientsInterestsRequest(src_dict=self.arguments)
             context["nclients"] = len(interests.client_ids)
-            return {cid: get_interests(store=store, cid=cid) for cid in interests.client_ids}
+            return get_interests_many(store, interests.client_ids)
 
         raise ValueError(f"Invalid method {self.method}")
 
+    def get_batch_response(self, context, store) -> dict:
+        """ Скоринг для массива аргументов online_score.
+        Ошибки валидации возвращаются для каждого элемента отдельно """
+        batch = OnlineScoreBatchRequest(src_dict=self.arguments)
+        results: typing.List[typing.Optional[dict]] = []
+        valid = []
+        for item in batch.items:
+            try:
+                online_score = OnlineScoreRequest(src_dict=item)
+                if not online_score.is_valid():
+                    raise ValueError("Invalid online_score request arguments")
+            except (TypeError, ValueError) as err:
+                results.append({"error": str(err), "code": INVALID_REQUEST})
+                continue
+            results.append(None)
+            valid.append((len(results) - 1, online_score))
+        if self.is_admin:
+            scores = [42] * len(valid)
+        else:
+            scores = get_scores(store, [online_score.to_dict() for _, online_score in valid])
+        for (idx, _), score in zip(valid, scores):
+            results[idx] = {"score": score}
+        context["nitems"] = len(results)
+        context["has"] = [online_score.non_empty_fields_lst for _, online_score in valid]
+        return {"scores": results}
+
 
 def method_handler(request, context, store):
     """ Обработчик вызываемых методов """
@@ -279,34 +488,97 @@ def method_handler(request, context, store):
     return response, code
 
 
+def metrics_handler(request, context, store):  # pylint: disable=unused-argument
+    """ Метрики сервиса в текстовом формате Prometheus """
+    return REGISTRY.render(), OK
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     """ Обработчик http запросов к сервису """
     router = {
-        "method": method_handler
+        "method": method_handler,
+    }
+    text_routes = {  # маршруты, доступные только GET запросом, ответ - текст
+        "metrics": metrics_handler,
     }
     store = KVStore()
+    serializer = get_serializer()
+    admission = ADMISSION
+    request_timeout = None  # срок обработки запроса, сек, None - без срока
+    access_log = AccessLog()  # не пишет, пока не вызван start()
 
     def get_request_id(self, headers):
         """ get_request_id """
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def get_metrics_label(self, request) -> str:
+        """ Метка запроса в метриках: имя метода или маршрута,
+        произвольные значения из запроса не попадают в метки """
+        path = self.path.strip("/")
+        if path != "method":
+            return path if path in self.router else "not_found"
+        method = request.get("method") if isinstance(request, dict) else None
+        return method if method in METHODS else "unknown"
+
+    # pylint: disable=invalid-name
+    def do_GET(self):
+        """ Текстовые маршруты, например метрики для Prometheus """
+        path = self.path.strip("/")
+        if path not in self.text_routes:
+            self.send_error(NOT_FOUND)
+            return
+        response, code = self.text_routes[path]({"body": None, "headers": self.headers},
+                                                {}, self.store)
+        body = response.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     # pylint: disable=invalid-name
     def do_POST(self):
         """ пользователи дергают методы POST запросами """
+        started = time.perf_counter()
+        if not self.admission.acquire():
+            self.reject()
+            return
+        try:
+            with deadline(self.request_timeout):
+                self.handle_post(started)
+        finally:
+            self.admission.release()
+
+    def reject(self):
+        """ Быстрый отказ при перегрузке, тело запроса не разбирается """
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(SERVICE_UNAVAILABLE)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(self.serializer.dumps(
+            {"error": ERRORS[SERVICE_UNAVAILABLE], "code": SERVICE_UNAVAILABLE}))
+        # отказ учитывается в scoring_rejected_requests_total, метка метода
+        # остается именем метода: тело не разобрано, поэтому "unknown"
+        self.access_log.log(SERVICE_UNAVAILABLE, path=self.path,
+                            method=self.get_metrics_label(None),
+                            client=self.client_address[0])
+
+    def handle_post(self, started):
+        """ Разбор запроса, вызов обработчика маршрута и ответ """
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
         request = None
         data_string = ""
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            request = self.serializer.loads(data_string)
         except Exception as exc:  # pylint: disable=broad-exception-caught
             logging.exception("BAD_REQUEST: %s", exc)
             code = BAD_REQUEST
 
         if request:
             path = self.path.strip("/")
-            logging.info("%s: %s %s", self.path, data_string, context["request_id"])
             if path in self.router:
                 try:
                     response, code = self.router[path](
@@ -317,6 +589,11 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
                 except ValueError as value_error:
                     response = str(value_error)
                     code = INVALID_REQUEST
+                except PoolTimeoutError as timeout_error:
+                    # все соединения заняты или хранилище не ответило до срока запроса
+                    # (DeadlineExceeded - подкласс PoolTimeoutError)
+                    logging.warning("SERVICE_UNAVAILABLE: %s", timeout_error)
+                    code = SERVICE_UNAVAILABLE
                 except Exception as e:  # pylint: disable=broad-exception-caught
                     logging.exception("INTERNAL_ERROR: %s", e)
                     code = INTERNAL_ERROR
@@ -330,9 +607,31 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
             r = {"response": response, "code": code}
         else:
             r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r).encode())
+        self.wfile.write(self.serializer.dumps(r))
+        label = self.get_metrics_label(request)
+        duration = time.perf_counter() - started
+        REQUESTS.inc(label, code)
+        REQUEST_LATENCY.observe(duration, label)
+        self.access_log.log(code, {"request": data_string, "response": r},
+                            path=self.path, method=label, client=self.client_address[0],
+                            duration_ms=round(duration * 1000, 3), **context)
+
+    def log_request(self, code="-", size="-"):
+        """ Обращения записываются в access_log после ответа """
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Сообщения BaseHTTPRequestHandler - в общий лог через очередь """
+        logging.info("%s - %s", self.client_address[0], format % args)
+
+
+def make_store(args) -> Store:
+    """ Создание хранилища выбранного типа """
+    if args.store == "memory":
+        return MemoryStore()
+    if args.store == "sqlite":
+        return SQLiteStore(args.store_path)
+    return KVStore(hosts=parse_hosts(args.store_hosts), pool_size=args.pool_size,
+                   write_behind=args.write_behind)
 
 
 def main():
@@ -343,13 +642,46 @@ def main():
     parser = argparse.ArgumentParser(description='Scoring API')
     parser.add_argument("--port", "-p", dest="port", default=8080, type=int)
     parser.add_argument("--log", "-l", dest="log", default=None, type=str)
+    parser.add_argument("--access-log", dest="access_log", default=None, type=str,
+                        help="JSON lines access log file, stdout by default")
+    parser.add_argument("--access-log-sample", dest="access_log_sample", default=1.0,
+                        type=float, help="share of successful requests written to access log")
+    parser.add_argument("--log-payload", dest="log_payload", action="store_true",
+                        help="write request and response bodies to access log")
+    parser.add_argument("--store", dest="store", default="tarantool",
+                        choices=["tarantool", "memory", "sqlite"])
+    parser.add_argument("--store-path", dest="store_path", default="store.sqlite3", type=str)
+    parser.add_argument("--store-hosts", dest="store_hosts", default="localhost:3301",
+                        type=str, help="tarantool instances, host:port separated by commas")
+    parser.add_argument("--pool-size", dest="pool_size", default=4, type=int)
+    parser.add_argument("--write-behind", dest="write_behind", action="store_true",
+                        help="write score cache to tarantool from a background thread")
+    parser.add_argument("--serializer", dest="serializer", default=None,
+                        choices=list(SERIALIZERS),
+                        help="JSON library, fastest available by default")
+    parser.add_argument("--interests-window", dest="interests_window", default=2.0, type=float,
+                        help="ms to gather clients_interests lookups into one store call, "
+                             "0 disables batching")
+    parser.add_argument("--max-inflight", dest="max_inflight", default=64, type=int,
+                        help="requests processed at once, 0 - unlimited")
+    parser.add_argument("--max-queue", dest="max_queue", default=64, type=int,
+                        help="requests waiting for a slot, the rest get 503 at once")
+    parser.add_argument("--queue-timeout", dest="queue_timeout", default=100, type=float,
+                        help="ms a request may wait for a slot before 503")
+    parser.add_argument("--request-timeout", dest="request_timeout", default=1000, type=float,
+                        help="ms deadline for store calls of a request, 0 - no deadline")
     args = parser.parse_args()
 
-    logging.basicConfig(filename=args.log, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s',
-                        datefmt='%Y.%m.%d %H:%M:%S')
+    log_listener = setup_logging(args.log)
+    MainHTTPHandler.access_log = AccessLog(args.access_log, args.access_log_sample,
+                                           args.log_payload).start()
 
-    server = HTTPServer(("localhost", args.port), MainHTTPHandler)
+    MainHTTPHandler.store = make_store(args)
+    MainHTTPHandler.serializer = get_serializer(args.serializer)
+    INTERESTS_BATCHER.window = args.interests_window / 1000
+    ADMISSION.configure(args.max_inflight, args.max_queue, args.queue_timeout / 1000)
+    MainHTTPHandler.request_timeout = args.request_timeout / 1000 or None
+    server = ThreadingHTTPServer(("localhost", args.port), MainHTTPHandler)
     logging.info("Starting server at %s", args.port)
     try:
         server.serve_forever()
@@ -358,6 +690,9 @@ def main():
     except:  # pylint: disable=bare-except
         logging.exception("Unexpected error")
     server.server_close()
+    MainHTTPHandler.store.close()
+    MainHTTPHandler.access_log.stop()
+    log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+""" Микро-бенчмарки обработки запросов к API скоринга
+
+python bench_api.py --number 100000 [--bench validation --bench auth --bench serializer]
+"""
+
+import argparse
+import hashlib
+import time
+import timeit
+
+import api
+import serializers
+
+REQUEST = {
+    "account": "horns&hoofs", "login": "h&f", "method": "online_score",
+    "token": hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest(),
+    "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru",
+                  "first_name": "Стансилав", "last_name": "Ступников",
+                  "birthday": "01.01.1990", "gender": 1},
+}
+
+
+def validation_cases():
+    """ Стоимость валидации запросов """
+    return {
+        "MethodRequest": lambda: api.MethodRequest(src_dict=REQUEST),
+        "OnlineScoreRequest": lambda: api.OnlineScoreRequest(src_dict=REQUEST["arguments"]),
+    }
+
+
+def auth_cases():
+    """ Стоимость аутентификации с кешем и без него """
+    request = api.MethodRequest(src_dict=REQUEST)
+    admin = api.MethodRequest(src_dict=dict(
+        REQUEST, login=api.ADMIN_LOGIN,
+        token=api.AuthCache.digest(time.strftime("%Y%m%d") + api.ADMIN_SALT)))
+    no_cache = api.AuthCache(maxsize=0)
+    return {
+        "check_auth": request.check_auth,
+        "check_auth (no cache)": lambda: no_cache.check(
+            request.account, request.login, request.token, False),
+        "check_auth admin": admin.check_auth,
+    }
+
+
+def serializer_cases():
+    """ Разбор запроса и сериализация ответа clients_interests на 50 клиентов """
+    body = serializers.JSONSerializer.dumps(REQUEST)
+    response = {"response": {cid: ["cars", "pets"] for cid in range(50)}, "code": api.OK}
+    cases = {}
+    for name, serializer in serializers.SERIALIZERS.items():
+        cases[f"{name} loads"] = lambda s=serializer: s.loads(body)
+        cases[f"{name} dumps"] = lambda s=serializer: s.dumps(response)
+    return cases
+
+
+BENCHMARKS = {
+    "validation": validation_cases,
+    "auth": auth_cases,
+    "serializer": serializer_cases,
+}
+
+
+def main():
+    """ Запуск бенчмарков и вывод стоимости одного вызова """
+    parser = argparse.ArgumentParser(description="Scoring API micro-benchmarks")
+    parser.add_argument("--number", "-n", default=100000, type=int)
+    parser.add_argument("--bench", "-b", action="append", choices=list(BENCHMARKS),
+                        help="benchmark to run, all by default")
+    args = parser.parse_args()
+
+    for bench in args.bench or BENCHMARKS:
+        for name, func in BENCHMARKS[bench]().items():
+            best = min(timeit.repeat(func, number=args.number, repeat=5))
+            print(f"{name:<24}{best / args.number * 1e6:>10.2f} us")
+
+
+if __name__ == "__main__":
+    main()
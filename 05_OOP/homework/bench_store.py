@@ -0,0 +1,84 @@
+""" Сравнение производительности хранилищ на сценариях get_score и get_interests
+
+python bench_store.py --ops 20000 --threads 4 --backends memory sqlite tarantool
+"""
+
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import threading
+import time
+
+from local_store import MemoryStore, SQLiteStore
+from scoring import get_interests, get_score
+from store import KVStore
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema",
+             "geek", "otus"]
+
+
+def make_store(name, tmpdir):
+    """ Создание хранилища по имени """
+    if name == "memory":
+        return MemoryStore()
+    if name == "sqlite":
+        return SQLiteStore(os.path.join(tmpdir, "bench.sqlite3"))
+    return KVStore()
+
+
+def score_scenario(store, ops, users):
+    """ Скоринг пользователей из ограниченного множества:
+    первый запрос по пользователю - промах кеша, остальные - попадания """
+    birthday = datetime.datetime(1990, 1, 1)
+    for _ in range(ops):
+        uid = random.randrange(users)
+        get_score(store, phone=f"7{uid:010d}", email=None, birthday=birthday, gender=1,
+                  first_name="Name", last_name=str(uid))
+
+
+def interests_scenario(store, ops, users):
+    """ Запросы интересов пачками по 10 клиентов """
+    for _ in range(ops // 10):
+        for _ in range(10):
+            get_interests(store, random.randrange(users))
+
+
+def run(store, scenario, ops, threads, users) -> float:
+    """ Запуск сценария в нескольких потоках, возвращает число операций в секунду """
+    per_thread = ops // threads
+    workers = [threading.Thread(target=scenario, args=(store, per_thread, users))
+               for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    """ Разбор параметров и вывод таблицы результатов """
+    parser = argparse.ArgumentParser(description="Store backends benchmark")
+    parser.add_argument("--ops", default=20000, type=int)
+    parser.add_argument("--threads", default=4, type=int)
+    parser.add_argument("--users", default=1000, type=int)
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"],
+                        choices=["memory", "sqlite", "tarantool"])
+    args = parser.parse_args()
+
+    print(f"{'backend':<12}{'get_score ops/s':>18}{'get_interests ops/s':>22}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in args.backends:
+            store = make_store(name, tmpdir)
+            for cid in range(args.users):
+                store.set(f"i:{cid}", random.sample(INTERESTS, 2))
+            score_rate = run(store, score_scenario, args.ops, args.threads, args.users)
+            interests_rate = run(store, interests_scenario, args.ops, args.threads, args.users)
+            print(f"{name:<12}{score_rate:>18.0f}{interests_rate:>22.0f}")
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+""" Пакетная загрузка интересов клиентов в хранилище
+
+Файл читается потоком, строки собираются в пачки по --batch-size,
+пачки записываются параллельно через --workers соединений (set_many).
+Номер последней строки, до которой все пачки записаны, сохраняется
+в файл контрольной точки, с --resume загрузка продолжается с него.
+
+Форматы входного файла:
+  csv   - заголовок cid,interests, интересы через ';'
+  jsonl - {"cid": 1, "interests": ["cars", "pets"]} в каждой строке
+
+python init_tarantool.py --index-type hash --memtx-memory 2147483648
+python bulk_load.py interests.csv --workers 8 --batch-size 5000
+python bulk_load.py interests.csv --resume
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+from local_store import SQLiteStore
+from store import KVStore, parse_hosts
+
+
+def read_rows(path: str, fmt: str):
+    """ Пары (cid, список интересов) из файла """
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                interests = row["interests"]
+                yield row["cid"], interests.split(";") if interests else []
+        else:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row["cid"], row["interests"]
+
+
+def read_batches(rows, batch_size: int, skip=0):
+    """ Пачки (номер строки после пачки, {ключ: интересы}),
+    первые skip строк пропускаются """
+    batch = {}
+    number = 0
+    for number, (cid, interests) in enumerate(rows, 1):
+        if number <= skip:
+            continue
+        batch[f"i:{cid}"] = interests
+        if len(batch) >= batch_size:
+            yield number, batch
+            batch = {}
+    if batch:
+        yield number, batch
+
+
+class Checkpoint:
+    """ Номер строки, до которой все пачки записаны.
+    Пачки завершаются не по порядку, отметка сдвигается
+    только когда записаны все предыдущие пачки """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._done = {}  # начало записанной пачки -> ее конец
+        self.position = self.load()
+
+    def load(self) -> int:
+        """ Сохраненная отметка, 0 если файла нет """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)["rows"]
+        except FileNotFoundError:
+            return 0
+
+    def done(self, start: int, end: int):
+        """ Пачка строк (start, end] записана """
+        with self._lock:
+            self._done[start] = end
+            moved = False
+            while self.position in self._done:
+                self.position = self._done.pop(self.position)
+                moved = True
+            if moved:
+                self._save()
+
+    def _save(self):
+        # запись во временный файл и замена, чтобы при обрыве не остался испорченный файл
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.position}, f)
+        os.replace(tmp, self.path)
+
+
+def submit(executor, slots, store, batch):
+    """ Запись пачки в пуле потоков, слот освобождается по ее завершении """
+    slots.acquire()  # pylint: disable=consider-using-with
+    future = executor.submit(store.set_many, batch)
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def collect(futures: list, checkpoint: Checkpoint, wait=False) -> int:
+    """ Учет записанных пачек по порядку, возвращает число их строк.
+    Без wait учитываются только уже завершенные пачки в начале списка """
+    loaded = 0
+    while futures and (wait or futures[0][3].done()):
+        first, last, count, future = futures.pop(0)
+        future.result()  # ошибка записи прерывает загрузку
+        checkpoint.done(first, last)
+        loaded += count
+    return loaded
+
+
+def load(store, batches, checkpoint: Checkpoint, workers: int, report_every=5.0) -> int:
+    """ Параллельная запись пачек, возвращает число записанных строк.
+    В работе не больше 2 * workers пачек, чтобы файл не читался в память целиком """
+    slots = threading.BoundedSemaphore(2 * workers)
+    start = checkpoint.position
+    loaded = 0
+    started = reported = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = []
+        for end, batch in batches:
+            futures.append((start, end, len(batch), submit(executor, slots, store, batch)))
+            start = end
+            loaded += collect(futures, checkpoint)
+            if time.perf_counter() - reported >= report_every:
+                reported = time.perf_counter()
+                print(f"{checkpoint.position} rows, {loaded / (reported - started):.0f} rows/sec",
+                      flush=True)
+        loaded += collect(futures, checkpoint, wait=True)
+    elapsed = time.perf_counter() - started
+    print(f"Loaded {loaded} rows in {elapsed:.1f} sec, {loaded / elapsed:.0f} rows/sec")
+    return loaded
+
+
+def get_params() -> argparse.Namespace:
+    """ Параметры командной строки """
+    parser = argparse.ArgumentParser(description="Bulk load client interests")
+    parser.add_argument("path", help="input file")
+    parser.add_argument("--format", default=None, choices=["csv", "jsonl"],
+                        help="by default from the file extension")
+    parser.add_argument("--store", default="tarantool", choices=["tarantool", "sqlite"])
+    parser.add_argument("--store-path", dest="store_path", default="store.sqlite3")
+    parser.add_argument("--store-hosts", dest="store_hosts", default="localhost:3301")
+    parser.add_argument("--workers", default=4, type=int, help="parallel connections")
+    parser.add_argument("--batch-size", dest="batch_size", default=5000, type=int)
+    parser.add_argument("--checkpoint", default=None,
+                        help="checkpoint file, by default <path>.checkpoint")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip rows already loaded according to the checkpoint")
+    return parser.parse_args()
+
+
+def main():
+    """ Загрузка файла в хранилище """
+    params = get_params()
+    fmt = params.format or ("jsonl" if params.path.endswith((".jsonl", ".json")) else "csv")
+    checkpoint_path = params.checkpoint or params.path + ".checkpoint"
+    if not params.resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    if checkpoint.position:
+        print(f"Resuming after row {checkpoint.position}")
+
+    if params.store == "sqlite":
+        store = SQLiteStore(params.store_path)
+    else:
+        store = KVStore(hosts=parse_hosts(params.store_hosts), pool_size=params.workers)
+    try:
+        batches = read_batches(read_rows(params.path, fmt), params.batch_size,
+                               checkpoint.position)
+        load(store, batches, checkpoint, params.workers)
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,150 @@
-""" Инициализация БД tarantool, используемой для тестов """
+""" Инициализация БД tarantool, используемой для тестов
+
+python init_tarantool.py [--host HOST] [--port PORT] [--engine memtx|vinyl]
+                         [--index-type tree|hash] [--memtx-memory BYTES]
+"""
+
+import argparse
 
 import tarantool
 
+# настройки фонового удаления просроченных записей кеша
+CACHE_SWEEP_BATCH = 1000  # сколько записей удаляется за одну транзакцию
+CACHE_SWEEP_INTERVAL = 1.0  # пауза между проходами, сек
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # предельный объем спейса кеша вместе с индексами
+
+
+def get_params() -> argparse.Namespace:
+    """ Параметры командной строки """
+    parser = argparse.ArgumentParser(description="Init tarantool spaces")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default=3301, type=int)
+    parser.add_argument("--engine", default="memtx", choices=["memtx", "vinyl"],
+                        help="engine of the client interests space, "
+                             "vinyl keeps data on disk for datasets larger than memory")
+    parser.add_argument("--index-type", dest="index_type", default="tree", choices=["tree", "hash"],
+                        help="primary index of the client interests space, "
+                             "hash is faster for bulk inserts and point lookups (memtx only)")
+    parser.add_argument("--memtx-memory", dest="memtx_memory", default=0, type=int,
+                        help="raise memtx arena to this many bytes before a bulk load")
+    params = parser.parse_args()
+    if params.engine == "vinyl" and params.index_type == "hash":
+        parser.error("vinyl engine supports only tree indexes")
+    return params
+
 
 def main():
-    """ Создание спейсов в БД """
+    """ Создание спейсов в БД и запуск фоновой очистки кеша """
+    params = get_params()
     lua_code = r"""
-        s = box.schema.space.create('test_scoring')
+        local batch, interval, max_bytes, engine, index_type, memtx_memory = ...
+        local fiber = require('fiber')
+
+        -- арену memtx можно только увеличить без перезапуска
+        if memtx_memory > box.cfg.memtx_memory then
+            box.cfg{memtx_memory = memtx_memory}
+        end
+
+        s = box.schema.space.create('test_scoring', {if_not_exists = true})
+        -- кеш старого формата (key, value) без срока жизни: записи без expires
+        -- не читаются KVStore.cache_get и не подходят под новый формат, кеш очищается
+        if #s:format() < 3 then
+            s:truncate()
+        end
         s:format({
                  {name = 'key', type = 'string'},
-                 {name = 'value', type = 'double'}
+                 {name = 'value', type = 'double'},
+                 {name = 'expires', type = 'double'}
                  })
-        s:create_index('primary', {type = 'tree', parts = {'key'}})
-        
-        s = box.schema.space.create('test_ci')
+        s:create_index('primary', {type = 'tree', parts = {'key'},
+                                   if_not_exists = true})
+        s:create_index('expires', {type = 'tree', parts = {'expires'}, unique = false,
+                                   if_not_exists = true})
+
+        s = box.schema.space.create('test_ci', {engine = engine, if_not_exists = true})
         s:format({
                  {name = 'key', type = 'string'},
                  {name = 'value', type = 'array'}
                  })
-        s:create_index('primary', {type = 'tree', parts = {'key'}})
+        s:create_index('primary', {type = index_type, parts = {'key'},
+                                   if_not_exists = true})
+
+        -- пакетные операции, см. KVStore.cache_get_many/cache_set_many/set_many
+        box.schema.func.create('kv_get_many', {
+            body = [[function(space_name, keys)
+                local space = box.space[space_name]
+                local result = {}
+                for _, key in ipairs(keys) do
+                    local t = space:get(key)
+                    if t ~= nil then
+                        table.insert(result, t)
+                    end
+                end
+                return result
+            end]],
+            if_not_exists = true})
+        box.schema.func.create('kv_put_many', {
+            body = [[function(space_name, tuples)
+                local space = box.space[space_name]
+                box.begin()
+                for _, t in ipairs(tuples) do
+                    space:replace(t)
+                end
+                box.commit()
+                return #tuples
+            end]],
+            if_not_exists = true})
+
+        -- удаляет до batch записей в порядке возрастания срока жизни,
+        -- only_expired = true - только те, у которых срок истек
+        local function evict(space, only_expired)
+            local keys = {}
+            local now = fiber.time()
+            for _, t in space.index.expires:pairs() do
+                if (only_expired and t.expires > now) or #keys >= batch then
+                    break
+                end
+                table.insert(keys, t.key)
+            end
+            box.begin()
+            for _, key in ipairs(keys) do
+                space:delete(key)
+            end
+            box.commit()
+            return #keys
+        end
+
+        local function space_bytes(space)
+            return space:bsize() + space.index.primary:bsize()
+                   + space.index.expires:bsize()
+        end
+
+        if scoring_sweeper ~= nil and scoring_sweeper:status() ~= 'dead' then
+            scoring_sweeper:cancel()
+        end
+        scoring_sweeper = fiber.create(function()
+            fiber.name('scoring_sweeper')
+            local space = box.space.test_scoring
+            while true do
+                local removed = evict(space, true)
+                while space_bytes(space) > max_bytes do
+                    if evict(space, false) == 0 then
+                        break
+                    end
+                    fiber.yield()
+                end
+                if removed < batch then
+                    fiber.sleep(interval)
+                else
+                    fiber.yield()
+                end
+            end
+        end)
         """
-    conn = tarantool.Connection('localhost', 3301)
-    print("Connected to tarantool instance port 3301")
-    conn.eval(lua_code, (1, 2))
+    conn = tarantool.Connection(params.host, params.port)
+    print(f"Connected to tarantool instance port {params.port}")
+    conn.eval(lua_code, (CACHE_SWEEP_BATCH, CACHE_SWEEP_INTERVAL, CACHE_MAX_BYTES,
+                         params.engine, params.index_type, params.memtx_memory))
     print("Initialized DB")
 
 
@@ -0,0 +1,315 @@
+""" Нагрузочное тестирование API скоринга
+
+Запускает сервер в этом же процессе с хранилищем FakeStore (задержка и отказы
+настраиваются), подает авторизованные запросы online_score и clients_interests
+в заданной пропорции и с заданной частотой, выводит задержки и пропускную способность.
+
+python loadtest.py --duration 10 --workers 8 --rate 500 --mix online_score=0.7,clients_interests=0.3
+python loadtest.py --save-baseline      # записать результат как эталон
+python loadtest.py                      # сравнить с эталоном, код 1 при деградации
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import typing
+
+import api
+from local_store import MemoryStore
+from store import PoolTimeoutError, time_left
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema",
+             "geek", "otus"]
+ACCOUNT, LOGIN = "loadtest", "loadtest"
+
+
+class FakeStore(MemoryStore):
+    """ Хранилище в памяти с искусственной задержкой и отказами,
+    имитирует сетевое хранилище """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, concurrency=0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        # одновременных обращений, как у пула соединений KVStore, 0 - без ограничения
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+
+    def _call(self):
+        """ Задержка обращения, True если обращение должно завершиться отказом.
+        Ожидание свободного слота ограничено сроком запроса, как в ConnectionPool """
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            if self._slots is None:
+                time.sleep(delay)
+            else:
+                remaining = time_left()
+                if not self._slots.acquire(timeout=None if remaining is None
+                                           else max(remaining, 0)):
+                    raise PoolTimeoutError("Deadline exceeded waiting for the store")
+                try:
+                    time.sleep(delay)
+                finally:
+                    self._slots.release()
+        return random.random() < self.failure_rate
+
+    def _cache_call(self):
+        """ Как _call, но кеш не бросает исключений """
+        try:
+            return self._call()
+        except PoolTimeoutError:
+            return True
+
+    def cache_get(self, key):
+        if self._cache_call():
+            return None
+        return super().cache_get(key)
+
+    def cache_set(self, key, value, ttl=30):
+        if not self._cache_call():
+            super().cache_set(key, value, ttl)
+
+    # пакетные методы платят задержку и рискуют отказом один раз на пачку,
+    # как одно обращение к сетевому хранилищу, поэтому ключи читаются
+    # методами MemoryStore мимо переопределенных выше одиночных
+
+    def _lookup(self, get, keys) -> dict:
+        """ Найденные значения ключей без задержки на каждый ключ """
+        result = {}
+        for key in keys:
+            value = get(self, key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def cache_get_many(self, keys) -> dict:
+        if self._cache_call():
+            return {}
+        return self._lookup(MemoryStore.cache_get, keys)
+
+    def cache_set_many(self, items: dict, ttl=30):
+        if not self._cache_call():
+            for key, value in items.items():
+                MemoryStore.cache_set(self, key, value, ttl)
+
+    def get(self, key):
+        if self._call():
+            raise ConnectionError("Injected store failure")
+        return super().get(key)
+
+    def get_many(self, keys) -> dict:
+        if self._call():
+            raise ConnectionError("Injected store failure")
+        return self._lookup(MemoryStore.get, keys)
+
+
+class QuietHandler(api.MainHTTPHandler):
+    """ Обработчик без записи каждого запроса в stderr """
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def parse_mix(mix: str) -> dict:
+    """ Разбор пропорции методов вида 'online_score=0.7,clients_interests=0.3' """
+    result = {}
+    for item in mix.split(","):
+        method, _, weight = item.partition("=")
+        if method not in ("online_score", "clients_interests"):
+            raise ValueError(f"Unknown method {method}")
+        result[method] = float(weight or 1)
+    return result
+
+
+def make_body(method: str, clients: int) -> bytes:
+    """ Тело авторизованного запроса со случайными аргументами """
+    request = {"account": ACCOUNT, "login": LOGIN, "method": method,
+               "token": hashlib.sha512((ACCOUNT + LOGIN + api.SALT).encode()).hexdigest()}
+    if method == "online_score":
+        uid = random.randrange(clients)
+        request["arguments"] = {"phone": f"7{uid:010d}", "email": f"user{uid}@otus.ru",
+                                "first_name": "User", "last_name": str(uid)}
+    else:
+        request["arguments"] = {"client_ids": random.sample(range(clients), 5)}
+    return json.dumps(request).encode()
+
+
+class LoadProfile(typing.NamedTuple):
+    """ Параметры нагрузки """
+    mix: dict  # метод -> доля запросов
+    rate: float  # запросов в секунду от всех потоков, 0 - без ограничения
+    workers: int
+    clients: int  # различных пользователей и клиентов в запросах
+
+    @property
+    def interval(self) -> float:
+        """ Пауза между запросами одного потока """
+        return self.workers / self.rate if self.rate else 0.0
+
+
+class LoadGenerator:
+    """ Потоки, подающие запросы с заданной частотой и собирающие задержки """
+
+    def __init__(self, address, profile: LoadProfile):
+        self.address = address
+        self.profile = profile
+        self.latencies = []
+        self.codes = {}
+        self._lock = threading.Lock()
+
+    def worker(self, deadline: float):
+        """ Подача запросов до наступления deadline """
+        latencies, codes = [], {}
+        methods, weights = list(self.profile.mix), list(self.profile.mix.values())
+        interval = self.profile.interval
+        next_at = time.perf_counter() + random.uniform(0, interval)
+        while True:
+            # задержка считается от запланированного момента запроса,
+            # чтобы перегрузка не скрывалась уменьшением частоты запросов
+            scheduled = time.perf_counter()
+            if interval:
+                scheduled, next_at = next_at, next_at + interval
+                pause = scheduled - time.perf_counter()
+                if pause > 0:
+                    time.sleep(pause)
+            if time.perf_counter() >= deadline:
+                break
+            method = random.choices(methods, weights)[0]
+            code = self.post(make_body(method, self.profile.clients))
+            latencies.append(time.perf_counter() - scheduled)
+            codes[code] = codes.get(code, 0) + 1
+        with self._lock:
+            self.latencies.extend(latencies)
+            for code, count in codes.items():
+                self.codes[code] = self.codes.get(code, 0) + count
+
+    def post(self, body: bytes):
+        """ Запрос к API, код ответа или connection_error """
+        try:
+            conn = http.client.HTTPConnection(*self.address, timeout=30)
+            conn.request("POST", "/method/", body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+        except OSError:
+            return "connection_error"
+        return response.status
+
+    def run(self, duration: float) -> dict:
+        """ Запуск потоков и сводка результатов """
+        deadline = time.perf_counter() + duration
+        threads = [threading.Thread(target=self.worker, args=(deadline,))
+                   for _ in range(self.profile.workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "codes": {str(code): count for code, count in self.codes.items()},
+        }
+
+
+def percentile(values: list, pct: float) -> float:
+    """ Перцентиль отсортированного списка """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """ Список деградаций относительно эталона """
+    problems = []
+    for key in ("p50_ms", "p99_ms"):
+        if result[key] > baseline[key] * (1 + tolerance):
+            problems.append(f"{key} {result[key]:.2f} > baseline {baseline[key]:.2f}")
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        problems.append(f"throughput {result['throughput']:.0f} < "
+                        f"baseline {baseline['throughput']:.0f}")
+    return problems
+
+
+def get_params() -> argparse.Namespace:
+    """ Параметры командной строки """
+    parser = argparse.ArgumentParser(description="Scoring API load test")
+    parser.add_argument("--duration", default=10.0, type=float, help="seconds")
+    parser.add_argument("--workers", default=8, type=int)
+    parser.add_argument("--rate", default=0.0, type=float,
+                        help="total requests per second, 0 - as fast as possible")
+    parser.add_argument("--mix", default="online_score=0.7,clients_interests=0.3")
+    parser.add_argument("--clients", default=10000, type=int, help="distinct users and clients")
+    parser.add_argument("--latency", default=0.0, type=float, help="store latency, seconds")
+    parser.add_argument("--jitter", default=0.0, type=float, help="extra random store latency")
+    parser.add_argument("--failure-rate", dest="failure_rate", default=0.0, type=float)
+    parser.add_argument("--store-concurrency", dest="store_concurrency", default=0, type=int,
+                        help="concurrent store calls, like the KVStore pool size, 0 - unlimited")
+    parser.add_argument("--interests-window", dest="interests_window", default=2.0, type=float,
+                        help="clients_interests batching window, ms, 0 disables batching")
+    parser.add_argument("--max-inflight", dest="max_inflight", default=0, type=int,
+                        help="admission control, requests processed at once, 0 - unlimited")
+    parser.add_argument("--max-queue", dest="max_queue", default=0, type=int)
+    parser.add_argument("--request-timeout", dest="request_timeout", default=0.0, type=float,
+                        help="ms deadline for store calls of a request, 0 - no deadline")
+    parser.add_argument("--baseline", default="loadtest_baseline.json")
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true")
+    parser.add_argument("--tolerance", default=0.2, type=float,
+                        help="allowed relative degradation against the baseline")
+    return parser.parse_args()
+
+
+def main():
+    """ Запуск сервера и нагрузки, сравнение с эталоном """
+    params = get_params()
+    logging.basicConfig(level=logging.CRITICAL)  # ошибки обработки видны в кодах ответов
+
+    store = FakeStore(latency=params.latency, jitter=params.jitter,
+                      failure_rate=params.failure_rate, concurrency=params.store_concurrency)
+    for cid in range(params.clients):
+        store.set(f"i:{cid}", random.sample(INTERESTS, 2))
+    QuietHandler.store = store
+    api.INTERESTS_BATCHER.window = params.interests_window / 1000
+    api.ADMISSION.configure(params.max_inflight, params.max_queue, 0.1)
+    QuietHandler.request_timeout = params.request_timeout / 1000 or None
+    server = api.ThreadingHTTPServer(("127.0.0.1", 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    profile = LoadProfile(parse_mix(params.mix), params.rate, params.workers, params.clients)
+    generator = LoadGenerator(server.server_address, profile)
+    result = generator.run(params.duration)
+    server.shutdown()
+    server.server_close()
+    result["store_lookups"] = api.INTERESTS_BATCHER.stats()["batches"]
+    print(json.dumps(result, indent=2))
+
+    if params.save_baseline:
+        with open(params.baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {params.baseline}")
+        return 0
+    try:
+        with open(params.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {params.baseline}, run with --save-baseline")
+        return 0
+    problems = compare(result, baseline, params.tolerance)
+    for problem in problems:
+        print("REGRESSION:", problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
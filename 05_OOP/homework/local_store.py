@@ -0,0 +1,238 @@
+""" Локальные реализации интерфейса хранилища store.Store,
+не требующие внешнего сервиса: в памяти процесса и в файле SQLite """
+
+import json
+import sqlite3
+import threading
+import time
+import weakref
+
+
+class MemoryStore:
+    """ Хранилище в памяти процесса.
+    Ключи разбиты на stripes частей, у каждой своя блокировка,
+    поэтому потоки, обращающиеся к разным ключам, не мешают друг другу """
+
+    def __init__(self, stripes=16, cache_size=100_000):
+        self._stripes = stripes
+        self._cache_size = max(cache_size // stripes, 1)  # предел записей кеша в части
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._cache = [{} for _ in range(stripes)]
+        self._store = [{} for _ in range(stripes)]
+
+    def _stripe(self, key) -> int:
+        return hash(key) % self._stripes
+
+    @property
+    def is_alive(self):
+        """ Хранилище в памяти доступно всегда """
+        return True
+
+    def cache_set(self, key, value, ttl=30):
+        """ Запись в кеш на ttl секунд, при переполнении части
+        вытесняется самая давняя запись """
+        idx = self._stripe(key)
+        cache = self._cache[idx]
+        with self._locks[idx]:
+            cache.pop(key, None)
+            cache[key] = (value, time.time() + ttl)
+            if len(cache) > self._cache_size:
+                del cache[next(iter(cache))]
+
+    def cache_get(self, key):
+        """ Запрос из кеша, просроченное значение удаляется """
+        idx = self._stripe(key)
+        with self._locks[idx]:
+            item = self._cache[idx].get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires > time.time():
+                return value
+            del self._cache[idx][key]
+        return None
+
+    def cache_get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из кеша """
+        result = {}
+        for key in keys:
+            value = self.cache_get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def cache_set_many(self, items: dict, ttl=30):
+        """ Запись нескольких значений в кеш """
+        for key, value in items.items():
+            self.cache_set(key, value, ttl)
+
+    def get(self, key):
+        """ Запрос из хранилища """
+        idx = self._stripe(key)
+        with self._locks[idx]:
+            return self._store[idx].get(key)
+
+    def get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из хранилища """
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set(self, key, value):
+        """ Запись в хранилище """
+        idx = self._stripe(key)
+        with self._locks[idx]:
+            self._store[idx][key] = value
+
+    def set_many(self, items: dict):
+        """ Запись нескольких значений в хранилище """
+        for key, value in items.items():
+            self.set(key, value)
+
+    def close(self):
+        """ Ресурсов для освобождения нет """
+
+
+class _ThreadMarker:  # pylint: disable=too-few-public-methods  # нужен только weakref
+    """ Живет в threading.local, уничтожается при завершении потока """
+    __slots__ = ("__weakref__",)
+
+
+class SQLiteStore:
+    """ Хранилище в файле SQLite в режиме WAL.
+    Каждый поток работает через собственное соединение,
+    читатели не блокируются писателем. Соединение закрывается
+    при завершении потока: сервер запускает поток на каждый запрос """
+    purge_every = 1000  # через сколько записей в кеш удалять просроченные
+    max_variables = 500  # ключей в одном запросе, SQLite ограничивает число параметров
+
+    def __init__(self, path="store.sqlite3"):
+        self._path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._writes = 0
+        conn = self._connection
+        conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                     "(key TEXT PRIMARY KEY, value REAL, expires REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        conn.execute("CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, value TEXT)")
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        """ Соединение текущего потока """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            marker = self._local.marker = _ThreadMarker()
+            with self._lock:
+                self._connections.append(conn)
+            weakref.finalize(marker, self._retire, conn)
+        return conn
+
+    def _retire(self, conn: sqlite3.Connection):
+        """ Закрытие соединения завершившегося потока """
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    @property
+    def is_alive(self):
+        """ Проверка, что файл базы доступен """
+        try:
+            self._connection.execute("SELECT 1")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def cache_set(self, key, value, ttl=30):
+        """ Запись в кеш на ttl секунд """
+        now = time.time()
+        conn = self._connection
+        conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, value, now + ttl))
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if purge:
+            conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+    def cache_get(self, key):
+        """ Запрос из кеша, просроченное значение считается отсутствующим """
+        row = self._connection.execute(
+            "SELECT value FROM cache WHERE key = ? AND expires > ?",
+            (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def cache_get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из кеша,
+        один запрос на каждые max_variables ключей """
+        return dict(self._select_many(
+            "SELECT key, value FROM cache WHERE key IN ({}) AND expires > ?",
+            keys, time.time()))
+
+    def _select_many(self, sql, keys, *params):
+        """ Пары (ключ, значение) для ключей, найденных запросом sql.
+        Вместо {} в sql подставляются параметры для max_variables ключей """
+        keys = {str(key): key for key in keys}
+        names = list(keys)
+        for start in range(0, len(names), self.max_variables):
+            chunk = names[start:start + self.max_variables]
+            rows = self._connection.execute(sql.format(", ".join("?" * len(chunk))),
+                                            (*chunk, *params))
+            for key, value in rows:
+                yield keys[key], value
+
+    def cache_set_many(self, items: dict, ttl=30):
+        """ Запись нескольких значений в кеш одной транзакцией """
+        expires = time.time() + ttl
+        self._executemany("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                          [(key, value, expires) for key, value in items.items()])
+
+    def _executemany(self, sql, rows):
+        """ Выполнение запроса для всех строк в одной транзакции """
+        conn = self._connection
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(sql, rows)
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, key):
+        """ Запрос из хранилища """
+        row = self._connection.execute(
+            "SELECT value FROM store WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из хранилища,
+        один запрос на каждые max_variables ключей """
+        return {key: json.loads(value) for key, value in
+                self._select_many("SELECT key, value FROM store WHERE key IN ({})", keys)}
+
+    def set(self, key, value):
+        """ Запись в хранилище """
+        self._connection.execute("INSERT OR REPLACE INTO store VALUES (?, ?)",
+                                 (key, json.dumps(value)))
+
+    def set_many(self, items: dict):
+        """ Запись нескольких значений в хранилище одной транзакцией """
+        self._executemany("INSERT OR REPLACE INTO store VALUES (?, ?)",
+                          [(key, json.dumps(value)) for key, value in items.items()])
+
+    def close(self):
+        """ Закрытие соединений всех потоков """
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,205 @@
+""" Метрики сервиса в формате Prometheus.
+Каждый поток пишет в собственный словарь без блокировок,
+словари потоков суммируются при выдаче метрик """
+
+import bisect
+import contextlib
+import threading
+import time
+import weakref
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ThreadMarker:  # pylint: disable=too-few-public-methods  # нужен только weakref
+    """ Живет в threading.local, уничтожается при завершении потока """
+    __slots__ = ("__weakref__",)
+
+
+class Registry:
+    """ Набор метрик и значения, накопленные потоками """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = {}  # id словаря потока -> словарь потока
+        self._retired = {}  # сумма значений завершившихся потоков
+        self._metrics = {}  # имя -> метрика
+        self._callbacks = []
+
+    def counter(self, name, documentation, labelnames=()):
+        """ Новый счетчик """
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """ Новая гистограмма """
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, kind, func):
+        """ Метрика, значение которой вычисляется при выдаче """
+        self._callbacks.append((name, documentation, kind, func))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def shard(self) -> dict:
+        """ Словарь значений текущего потока """
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            marker = self._local.marker = _ThreadMarker()
+            with self._lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(marker, self._retire, shard)
+        return shard
+
+    def _retire(self, shard: dict):
+        """ Перенос значений завершившегося потока в общую сумму """
+        with self._lock:
+            self._shards.pop(id(shard), None)
+            self._merge(self._retired, shard)
+
+    @staticmethod
+    def _merge(total: dict, shard: dict):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                acc = total.setdefault(key, [0] * len(value))
+                for i, item in enumerate(value):
+                    acc[i] += item
+            else:
+                total[key] = total.get(key, 0) + value
+
+    def collect(self) -> dict:
+        """ Сумма значений всех потоков: (имя, метки) -> значение """
+        with self._lock:
+            total = {}
+            self._merge(total, self._retired)
+            shards = list(self._shards.values())
+        for shard in shards:
+            self._merge(total, shard.copy())
+        return total
+
+    def render(self) -> str:
+        """ Метрики в текстовом формате Prometheus """
+        values = self.collect()
+        by_name = {}
+        for (name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in by_name.get(name, []):
+                lines.extend(metric.render(labels, value))
+        for name, documentation, kind, func in self._callbacks:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {func()}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(names, values, extra="") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """ Монотонно растущий счетчик """
+    kind = "counter"
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels, value=1):
+        """ Увеличение счетчика с заданными значениями меток """
+        shard = self._registry.shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def render(self, labels, value):
+        """ Строки выдачи для одного набора меток """
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"]
+
+
+class Histogram:
+    """ Распределение значений по корзинам """
+    kind = "histogram"
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """ Учет значения: корзины, затем сумма и количество """
+        shard = self._registry.shard()
+        key = (self.name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        """ Замер времени выполнения блока with """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self, labels, value):
+        """ Строки выдачи для одного набора меток, корзины накопительные """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), value):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} "
+                         f"{cumulative}")
+        label_str = _format_labels(self.labelnames, labels)
+        lines.append(f"{self.name}_sum{label_str} {value[-2]}")
+        lines.append(f"{self.name}_count{label_str} {value[-1]}")
+        return lines
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("scoring_requests_total",
+                            "API requests by method and response code", ("method", "code"))
+REQUEST_LATENCY = REGISTRY.histogram("scoring_request_duration_seconds",
+                                     "API request latency by method", ("method",))
+STORE_LATENCY = REGISTRY.histogram("scoring_store_duration_seconds",
+                                   "Store call latency by operation", ("operation",))
+STORE_ERRORS = REGISTRY.counter("scoring_store_errors_total",
+                                "Store call errors by operation and error type",
+                                ("operation", "error"))
+CACHE_WRITES_DROPPED = REGISTRY.counter("scoring_cache_writes_dropped_total",
+                                        "Write-behind cache writes dropped on a full queue")
+CACHE_REQUESTS = REGISTRY.counter("scoring_cache_requests_total",
+                                  "Score cache lookups by result", ("result",))
+
+
+@contextlib.contextmanager
+def observe_store(operation):
+    """ Замер времени и учет ошибок обращения к хранилищу """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as err:
+        STORE_ERRORS.inc(operation, err.__class__.__name__)
+        raise
+    finally:
+        STORE_LATENCY.observe(time.perf_counter() - start, operation)
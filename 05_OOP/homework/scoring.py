@@ -1,28 +1,174 @@
 """ Расчет скоринга """
 
 import hashlib
+import threading
 
-from store import KVStore
+from metrics import CACHE_REQUESTS, REGISTRY
+from store import Store, time_left
 
+SCORE_TTL = 60 * 60  # время жизни скоринга в кеше, сек
+CACHE_MIN_TIME = 0.05  # если до срока запроса осталось меньше, сек, кеш не используется
 
-# pylint: disable=too-many-arguments
-def get_score(store: KVStore, phone, email,
-              birthday=None, gender=None, first_name=None, last_name=None):
-    """ Пытаемся получить скоринг из кеша,
-    если там нет, то расчет скоринга
-    в зависимости от заполненных полей """
+
+class _Call:  # pylint: disable=too-few-public-methods  # только данные
+    """ Выполняющееся вычисление, его ждут все вызовы с тем же ключом """
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Объединение одновременных вычислений с одинаковым ключом:
+    первый вызов выполняет функцию, остальные ждут и получают его результат """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0  # выполненных вычислений
+        self.coalesced = 0  # вызовов, получивших чужой результат
+
+    def do(self, key, func):
+        """ Результат func(), одновременно для ключа выполняется одно вычисление """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self) -> dict:
+        """ Счетчики вычислений """
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced}
+
+
+SCORE_FLIGHT = SingleFlight()
+REGISTRY.callback("scoring_singleflight_coalesced_total",
+                  "get_score cache misses served by a concurrent computation",
+                  "counter", lambda: SCORE_FLIGHT.coalesced)
+
+
+class _Batch:  # pylint: disable=too-few-public-methods  # только данные
+    """ Ключи, собранные за окно ожидания, и результат их запроса """
+    __slots__ = ("keys", "full", "done", "result", "error")
+
+    def __init__(self):
+        self.keys = set()
+        self.full = threading.Event()  # набрано max_keys, ждать окно до конца не нужно
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class KeyBatcher:
+    """ Объединение одновременных запросов ключей из хранилища.
+    Первый вызов открывает пачку и ждет window секунд, ключи вызовов,
+    пришедших за это время, добавляются в пачку. Затем пачка запрашивается
+    одним store.get_many и каждый вызов получает свои ключи.
+    window = 0 - без ожидания, каждый вызов запрашивает свои ключи сам """
+
+    def __init__(self, window=0.002, max_keys=1000):
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._open = {}  # хранилище -> пачка, в которую еще добавляются ключи
+        self.batches = 0  # запросов к хранилищу
+        self.requests = 0  # вызовов get_many
+
+    def get_many(self, store: Store, keys) -> dict:
+        """ Значения найденных ключей """
+        if not self.window:
+            with self._lock:
+                self.batches += 1
+                self.requests += 1
+            return store.get_many(keys)
+        with self._lock:
+            self.requests += 1
+            batch = self._open.get(store)
+            leader = batch is None
+            if leader:
+                batch = self._open[store] = _Batch()
+                self.batches += 1
+            batch.keys.update(keys)
+            if len(batch.keys) >= self.max_keys:
+                del self._open[store]
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(store) is batch:
+                    del self._open[store]
+            try:
+                batch.result = store.get_many(batch.keys)
+            except Exception as err:
+                batch.error = err
+                raise
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+        return {key: batch.result[key] for key in keys if key in batch.result}
+
+    def stats(self) -> dict:
+        """ Счетчики вызовов и запросов к хранилищу """
+        with self._lock:
+            return {"requests": self.requests, "batches": self.batches}
+
+
+INTERESTS_BATCHER = KeyBatcher()
+REGISTRY.callback("scoring_interests_lookups_total",
+                  "clients_interests store lookups after batching",
+                  "counter", lambda: INTERESTS_BATCHER.batches)
+REGISTRY.callback("scoring_interests_requests_total",
+                  "clients_interests lookups requested before batching",
+                  "counter", lambda: INTERESTS_BATCHER.requests)
+
+
+def _no_time_for_cache() -> bool:
+    """ До срока запроса осталось слишком мало, чтобы ждать кеш:
+    скоринг дешевле посчитать, чем рисковать ответом после срока """
+    remaining = time_left()
+    return remaining is not None and remaining < CACHE_MIN_TIME
+
+
+def score_key(phone=None, birthday=None, first_name=None, last_name=None) -> str:
+    """ Ключ кеша скоринга """
     key_parts = [
         first_name or "",
         last_name or "",
         phone or "",
         birthday.strftime("%Y%m%d") if birthday is not None else "",
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
-    score = store.cache_get(key) or 0
-    if score:
-        return score
+    return "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
+
+
+# pylint: disable=too-many-arguments
+def compute_score(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    """ Расчет скоринга в зависимости от заполненных полей """
+    score = 0
     if phone:
         score += 1.5
     if email:
@@ -31,15 +177,74 @@ def get_score(store: KVStore, phone, email,
         score += 1.5
     if first_name and last_name:
         score += 0.5
-    # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
     return score
 
 
-def get_interests(store: KVStore, cid):
+# pylint: disable=too-many-arguments
+def get_score(store: Store, phone, email,
+              birthday=None, gender=None, first_name=None, last_name=None):
+    """ Пытаемся получить скоринг из кеша,
+    если там нет, то расчет скоринга
+    в зависимости от заполненных полей """
+    if _no_time_for_cache():
+        CACHE_REQUESTS.inc("skipped")
+        return compute_score(phone, email, birthday, gender, first_name, last_name)
+    key = score_key(phone, birthday, first_name, last_name)
+    # try get from cache,
+    # fallback to heavy calculation in case of cache miss
+    score = store.cache_get(key) or 0
+    if score:
+        CACHE_REQUESTS.inc("hit")
+        return score
+    CACHE_REQUESTS.inc("miss")
+
+    def compute_and_cache():
+        score = compute_score(phone, email, birthday, gender, first_name, last_name)
+        # cache for 60 minutes
+        store.cache_set(key, score, SCORE_TTL)
+        return score
+
+    # одновременные промахи по одному ключу ждут одного расчета и одной записи в кеш
+    return SCORE_FLIGHT.do(key, compute_and_cache)
+
+
+def get_scores(store: Store, items: list) -> list:
+    """ Скоринг для списка словарей аргументов get_score.
+    Кеш читается одним запросом, посчитанные значения записываются одним запросом """
+    if _no_time_for_cache():
+        CACHE_REQUESTS.inc("skipped", value=len(items))
+        return [compute_score(**item) for item in items]
+    keys = [score_key(item.get("phone"), item.get("birthday"),
+                      item.get("first_name"), item.get("last_name")) for item in items]
+    cached = store.cache_get_many(set(keys))
+    CACHE_REQUESTS.inc("hit", value=len(cached))
+    CACHE_REQUESTS.inc("miss", value=len(set(keys)) - len(cached))
+    computed = {}
+    scores = []
+    for key, item in zip(keys, items):
+        score = cached.get(key) or computed.get(key)
+        if not score:
+            score = compute_score(**item)
+            computed[key] = score
+        scores.append(score)
+    if computed:
+        store.cache_set_many(computed, SCORE_TTL)
+    return scores
+
+
+def get_interests(store: Store, cid):
     """ Получение списка интересов клиента """
     # interests = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema",
     #              "geek", "otus"]
     # return random.sample(interests, 2)
     r = store.get(f"i:{cid}")
     return r if r else []
+
+
+def get_interests_many(store: Store, cids,
+                       batcher: KeyBatcher = INTERESTS_BATCHER) -> dict:
+    """ Интересы нескольких клиентов, запрос к хранилищу объединяется
+    с запросами других потоков (см. KeyBatcher) """
+    keys = {cid: f"i:{cid}" for cid in cids}
+    found = batcher.get_many(store, keys.values())
+    return {cid: found.get(key) or [] for cid, key in keys.items()}
@@ -0,0 +1,59 @@
+""" Сериализация JSON для запросов и ответов API.
+Используется orjson, если он установлен, иначе стандартный модуль json """
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    """ Объекты, не представимые в JSON (например, исключения), отдаются строкой """
+    return str(obj)
+
+
+class JSONSerializer:
+    """ Сериализатор на стандартном модуле json """
+    name = "json"
+
+    @staticmethod
+    def loads(data):
+        """ Разбор JSON из bytes или str """
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        """ Сериализация в bytes """
+        return json.dumps(obj, default=_default).encode()
+
+
+class ORJSONSerializer:  # pylint: disable=no-member  # orjson - C-расширение
+    """ Сериализатор на orjson, ключи словарей могут быть не только строками """
+    name = "orjson"
+
+    @staticmethod
+    def loads(data):
+        """ Разбор JSON из bytes или str """
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        """ Сериализация в bytes """
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+SERIALIZERS = {JSONSerializer.name: JSONSerializer}
+if orjson is not None:
+    SERIALIZERS[ORJSONSerializer.name] = ORJSONSerializer
+
+
+def get_serializer(name=None):
+    """ Сериализатор по имени, по умолчанию самый быстрый из доступных """
+    if name is None:
+        return SERIALIZERS.get(ORJSONSerializer.name, JSONSerializer)
+    try:
+        return SERIALIZERS[name]
+    except KeyError as exc:
+        raise ValueError(f"Serializer {name} is not available") from exc
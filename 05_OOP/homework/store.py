@@ -1,94 +1,409 @@
 """ Модуль для обращения к key-value хранилищу tarantool """
+import bisect
+import contextlib
+import contextvars
+import hashlib
+import queue
+import threading
+import time
+import typing
+
 import tarantool
 
+from metrics import CACHE_WRITES_DROPPED, observe_store
 
-class KVStore:
-    """ Класс для реализации основных функций работы с хранилищем """
-    _store_name = 'test_ci'  # space в tarantool где реализован store
-    _cache_name = 'test_scoring'  # space в tarantool где реализован cache
 
-    def __init__(self, port=3301, host='localhost',
+class Store(typing.Protocol):
+    """ Интерфейс хранилища, с которым работает скоринг.
+    Кеш может терять данные и не должен бросать исключений,
+    хранилище (get/set) - источник истины """
+
+    @property
+    def is_alive(self) -> bool:
+        """ Проверка доступности хранилища """
+
+    def cache_get(self, key):
+        """ Запрос из кеша, None если значения нет или оно просрочено """
+
+    def cache_set(self, key, value, ttl=30):
+        """ Запись в кеш на ttl секунд """
+
+    def cache_get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из кеша, в ответе только найденные """
+
+    def cache_set_many(self, items: dict, ttl=30):
+        """ Запись нескольких значений в кеш на ttl секунд """
+
+    def get(self, key):
+        """ Запрос из хранилища, None если значения нет """
+
+    def get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из хранилища, в ответе только найденные """
+
+    def set(self, key, value):
+        """ Запись в хранилище """
+
+    def set_many(self, items: dict):
+        """ Запись нескольких значений в хранилище """
+
+    def close(self):
+        """ Освобождение ресурсов """
+
+
+class PoolTimeoutError(Exception):
+    """ За отведенное время не удалось получить соединение из пула """
+
+
+class DeadlineExceeded(PoolTimeoutError):
+    """ Время на обработку запроса истекло до обращения к хранилищу или во время него """
+
+
+_DEADLINE = contextvars.ContextVar("store_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """ Ограничение времени обращений к хранилищу внутри блока with.
+    Срок хранится в contextvars, поэтому действует на все вызовы
+    хранилища из текущего потока, без передачи через аргументы """
+    token = _DEADLINE.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def time_left():
+    """ Сколько секунд осталось до срока, None если срок не задан """
+    expires = _DEADLINE.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+class ConnectionPool:
+    """ Пул соединений с одним экземпляром tarantool.
+    Соединения открываются по требованию, одновременно выдается
+    не больше size соединений """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, host='localhost', port=3301, size=4, checkout_timeout=5,
                  reconnect_attempts=3, timeout=20):
-        self._port = port
-        self._host = host
+        self.host = host
+        self.port = port
+        self._checkout_timeout = checkout_timeout
         self._reconnect_attempts = reconnect_attempts
         self._timeout = timeout
-        self.connection = None
-        self.cache_space = None
-        self.store_space = None
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
 
-        self.connect()
-        self.init_cache()
-        self.init_store()
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.host}:{self.port})"
 
-    def connect(self):
-        """ Подключение к хранилищу """
+    def _connect(self):
+        """ Открытие нового соединения """
         try:
-            self.connection = tarantool.connection.Connection(
-                host=self._host, port=self._port,
+            return tarantool.connection.Connection(
+                host=self.host, port=self.port,
                 reconnect_max_attempts=self._reconnect_attempts,
-                connection_timeout=self._timeout)
-            print(f"Connected to tarantool service at {self._host, self._port}")
+                connection_timeout=self._timeout, socket_timeout=self._timeout)
         except tarantool.error.NetworkError:
-            print(f"Error connecting to tarantool service at {self._host, self._port}")
-            return False
-        return True
+            print(f"Error connecting to tarantool service at {self.host, self.port}")
+            raise
 
-    def init_cache(self):
-        """ Подключение к спейсу в тарантул где живет кеш """
-        if self.is_alive:
+    @staticmethod
+    def _set_timeout(conn, timeout):
+        """ Таймаут операций на сокете соединения """
+        sock = getattr(conn, "_socket", None)
+        if sock is not None:
+            sock.settimeout(timeout)
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """ Выдача соединения из пула на время блока with.
+        Если задан срок (см. deadline), ожидание соединения и операции
+        на нем ограничены оставшимся временем.
+        Соединение, на котором произошла сетевая ошибка, закрывается
+        и в пул не возвращается. Сетевая ошибка после истечения срока
+        (сработал укороченный таймаут сокета) - DeadlineExceeded """
+        timeout = self._checkout_timeout if timeout is None else timeout
+        remaining = time_left()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline exceeded before {self.host, self.port} call")
+            timeout = min(timeout, remaining)
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolTimeoutError(f"No free connection to {self.host, self.port} "
+                                   f"in {timeout} s")
+        conn = None
+        try:
             try:
-                self.cache_space = self.connection.space(self._cache_name)
-            except tarantool.error.SchemaError:
-                print(f"There's no space with name '{self._cache_name}'")
-                return False
-            return True
-        return False
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            remaining = time_left()
+            if remaining is not None:
+                self._set_timeout(conn, max(min(remaining, self._timeout), 0.001))
+            yield conn
+        except tarantool.error.NetworkError as err:
+            if conn is not None:
+                conn.close()
+                conn = None
+            if remaining is not None and time_left() <= 0:
+                raise DeadlineExceeded(f"Deadline exceeded during {self.host, self.port} call") \
+                    from err
+            raise
+        finally:
+            if conn is not None:
+                if remaining is not None:
+                    self._set_timeout(conn, self._timeout)
+                self._idle.put(conn)
+            self._slots.release()
 
-    def init_store(self):
-        """ Подключение к спейсу в тарантул где живет store """
+    def close(self):
+        """ Закрытие всех свободных соединений """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class HashRing:  # pylint: disable=too-few-public-methods  # нужен только get_node
+    """ Консистентное хеширование ключей по узлам,
+    каждый узел представлен на кольце replicas точками """
+
+    def __init__(self, nodes, replicas=100):
+        self._points = []
+        self._nodes = []
+        for node in nodes:
+            for i in range(replicas):
+                self._points.append(self._hash(f"{node}#{i}"))
+                self._nodes.append(node)
+        order = sorted(range(len(self._points)), key=self._points.__getitem__)
+        self._points = [self._points[i] for i in order]
+        self._nodes = [self._nodes[i] for i in order]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+    def get_node(self, key):
+        """ Узел, за которым закреплен ключ """
+        idx = bisect.bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._nodes[idx]
+
+
+class WriteBehindBuffer:
+    """ Отложенная запись в кеш: значения попадают в ограниченную очередь,
+    фоновый поток записывает их пачками. При переполнении очереди запись
+    отбрасывается - это кеш, потеря значения приводит лишь к повторному расчету """
+
+    def __init__(self, flush, maxsize=10000, batch_size=500, interval=0.05):
+        self._flush = flush  # функция записи списка (key, value, expires)
+        self._queue = queue.Queue(maxsize)
+        self._batch_size = batch_size
+        self._interval = interval
+        self._stopped = threading.Event()
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="cache-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, key, value, expires) -> bool:
+        """ Постановка записи в очередь, False если запись отброшена """
         try:
-            self.store_space = self.connection.space(self._store_name)
-        except tarantool.error.SchemaError:
-            print(f"There's no space with name '{self._store_name}'")
+            self._queue.put_nowait((key, value, expires))
+        except queue.Full:
+            with self._queue.mutex:  # put вызывают потоки запросов одновременно
+                self.dropped += 1
+            CACHE_WRITES_DROPPED.inc()
             return False
         return True
 
+    def _run(self):
+        """ Запись пачек до остановки и опустошения очереди """
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = {}
+            try:
+                item = self._queue.get(timeout=self._interval)
+                batch[item[0]] = item
+                while len(batch) < self._batch_size:
+                    item = self._queue.get_nowait()
+                    batch[item[0]] = item
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self._flush(list(batch.values()))
+                except Exception as err:  # pylint: disable=broad-exception-caught
+                    # поток записи не должен завершаться из-за ошибки одной пачки
+                    print(f"Error writing {len(batch)} cache values: {err}")
+
+    def close(self, timeout=5):
+        """ Запись оставшихся значений и остановка потока """
+        self._stopped.set()
+        self._thread.join(timeout)
+
+
+def parse_hosts(hosts: str):
+    """ Разбор списка узлов вида 'host1:3301,host2:3301' """
+    result = []
+    for item in hosts.split(","):
+        host, _, port = item.strip().rpartition(":")
+        result.append((host or 'localhost', int(port)))
+    return result
+
+
+class KVStore:
+    """ Класс для реализации основных функций работы с хранилищем.
+    Работает через пул соединений, при нескольких узлах
+    ключи распределяются между ними консистентным хешированием """
+    _store_name = 'test_ci'  # space в tarantool где реализован store
+    _cache_name = 'test_scoring'  # space в tarantool где реализован cache
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, port=3301, host='localhost',
+                 reconnect_attempts=3, timeout=20,
+                 hosts=None, pool_size=4, checkout_timeout=5,
+                 write_behind=False, write_behind_size=10000):
+        hosts = hosts or [(host, port)]
+        self.pools = [ConnectionPool(host=h, port=p, size=pool_size,
+                                     checkout_timeout=checkout_timeout,
+                                     reconnect_attempts=reconnect_attempts,
+                                     timeout=timeout)
+                      for h, p in hosts]
+        self._ring = HashRing(self.pools) if len(self.pools) > 1 else None
+        self._write_behind = WriteBehindBuffer(self._put_cache_tuples, write_behind_size) \
+            if write_behind else None
+
+    def _pool(self, key) -> ConnectionPool:
+        """ Пул узла, на котором хранится ключ """
+        if self._ring is None:
+            return self.pools[0]
+        return self._ring.get_node(key)
+
+    def _group_by_pool(self, keys) -> dict:
+        """ Разбиение ключей по узлам """
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._pool(key), []).append(key)
+        return groups
+
     @property
     def is_alive(self):
-        """ Проверка подключения """
-        if not self.connection:
-            return False
-        status = self.connection.ping(notime=True)
-        if status == "Success":
-            return True
-        return False
+        """ Проверка подключения ко всем узлам """
+        for pool in self.pools:
+            try:
+                with observe_store("ping"), pool.connection() as conn:
+                    if conn.ping(notime=True) != "Success":
+                        return False
+            except (tarantool.error.NetworkError, PoolTimeoutError):
+                return False
+        return True
 
-    def cache_set(self, key, value, time=30):
-        """ Запись в кеш
-        если значение с этим ключом там есть, меняем значение """
-        if self.is_alive:
-            self.cache_space.upsert((key, value, time), [("=", 1, value), ("=", 2, time)])
+    def cache_set(self, key, value, ttl=30):
+        """ Запись в кеш на ttl секунд
+        если значение с этим ключом там есть, меняем значение и срок жизни.
+        Хранится абсолютный момент истечения, просроченные записи
+        удаляет фоновый процесс в tarantool (см. init_tarantool.py).
+        В режиме write_behind запись выполняется фоновым потоком.
+        Недоступность кеша не считается ошибкой """
+        expires = time.time() + ttl
+        if self._write_behind is not None:
+            self._write_behind.put(key, value, expires)
+            return
+        try:
+            with observe_store("cache_set"), self._pool(key).connection() as conn:
+                conn.upsert(self._cache_name, (key, value, expires),
+                            [("=", 1, value), ("=", 2, expires)])
+        except (tarantool.error.NetworkError, PoolTimeoutError):
+            pass
 
     def cache_get(self, key):
-        """ Запрос из кеша """
-        if not self.is_alive:
+        """ Запрос из кеша, просроченное значение считается отсутствующим """
+        try:
+            with observe_store("cache_get"), self._pool(key).connection() as conn:
+                responce: tarantool.response.Response = conn.select(self._cache_name, key)
+        except (tarantool.error.NetworkError, PoolTimeoutError):
             return None
-        responce: tarantool.response.Response = self.cache_space.select(key)
         if responce.rowcount == 1:
-            return responce.data[0][1]
+            _, value, expires = responce.data[0]
+            if expires > time.time():
+                return value
         return None
 
+    def cache_get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из кеша, по одному вызову
+        хранимой функции kv_get_many на узел (см. init_tarantool.py) """
+        result = {}
+        now = time.time()
+        for pool, pool_keys in self._group_by_pool(keys).items():
+            try:
+                with observe_store("cache_get_many"), pool.connection() as conn:
+                    responce = conn.call("kv_get_many", self._cache_name, pool_keys)
+            except (tarantool.error.NetworkError, PoolTimeoutError):
+                continue
+            for key, value, expires in responce.data[0]:
+                if expires > now:
+                    result[key] = value
+        return result
+
+    def cache_set_many(self, items: dict, ttl=30):
+        """ Запись нескольких значений в кеш, по одной транзакции на узел """
+        expires = time.time() + ttl
+        if self._write_behind is not None:
+            for key, value in items.items():
+                self._write_behind.put(key, value, expires)
+            return
+        self._put_cache_tuples([(key, value, expires) for key, value in items.items()])
+
+    def _put_cache_tuples(self, tuples):
+        """ Запись кортежей (key, value, expires) в кеш,
+        по одному вызову хранимой функции kv_put_many на узел """
+        groups = {}
+        for item in tuples:
+            groups.setdefault(self._pool(item[0]), []).append(item)
+        for pool, pool_tuples in groups.items():
+            try:
+                with observe_store("cache_set_many"), pool.connection() as conn:
+                    conn.call("kv_put_many", self._cache_name, pool_tuples)
+            except (tarantool.error.NetworkError, PoolTimeoutError):
+                continue
+
     def get(self, key):
         """ Запрос из хранилища """
-        responce: tarantool.response.Response = self.store_space.select(key)
+        with observe_store("get"), self._pool(key).connection() as conn:
+            responce: tarantool.response.Response = conn.select(self._store_name, key)
         if responce.rowcount == 1:
             return responce.data[0][1]
         return None
 
+    def get_many(self, keys) -> dict:
+        """ Запрос нескольких ключей из хранилища,
+        по одному вызову kv_get_many на узел """
+        result = {}
+        for pool, pool_keys in self._group_by_pool(keys).items():
+            with observe_store("get_many"), pool.connection() as conn:
+                responce = conn.call("kv_get_many", self._store_name, pool_keys)
+            result.update((key, value) for key, value in responce.data[0])
+        return result
+
     def set(self, key, value):
         """ Запись в хранилище """
-        self.store_space.upsert((key, value), [("=", 1, value)])
+        with observe_store("set"), self._pool(key).connection() as conn:
+            conn.upsert(self._store_name, (key, value), [("=", 1, value)])
+
+    def set_many(self, items: dict):
+        """ Запись нескольких значений в хранилище,
+        по одной транзакции kv_put_many на узел """
+        for pool, keys in self._group_by_pool(items).items():
+            with observe_store("set_many"), pool.connection() as conn:
+                conn.call("kv_put_many", self._store_name, [(key, items[key]) for key in keys])
+
+    def close(self):
+        """ Запись отложенных значений кеша и закрытие соединений со всеми узлами """
+        if self._write_behind is not None:
+            self._write_behind.close()
+        for pool in self.pools:
+            pool.close()
 
 
 def main():
@@ -99,6 +414,7 @@ def main():
     store.cache_set(12, '12', 30)
     data = store.cache_get(12)
     print("Данные из кеша (12):", data)
+    store.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,50 @@
+""" Тесты журнала обращений access_log.py """
+
+import json
+import os
+import tempfile
+import unittest
+
+from access_log import AccessLog
+
+
+class AccessLogTestCase(unittest.TestCase):
+    """ Тесты записи, выборки и тел запросов """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.tmpdir.name, "access.log")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self):
+        """ Записи журнала """
+        with open(self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_json_lines(self):
+        """ Каждая запись - строка JSON с кодом ответа и переданными полями,
+        тело запроса без режима debug не записывается """
+        log = AccessLog(self.path).start()
+        log.log(200, {"request": b"{}"}, path="/method/", duration_ms=1.5)
+        log.stop()
+        entry, = self.read()
+        self.assertEqual((entry["status"], entry["path"], entry["duration_ms"]),
+                         (200, "/method/", 1.5))
+        self.assertIn("time", entry)
+        self.assertNotIn("payload", entry)
+
+    def test_sampling(self):
+        """ При выборке пропускаются успешные ответы, ошибки записываются всегда """
+        log = AccessLog(self.path, sample_rate=0.0, debug=True).start()
+        log.log(200, path="/ok")
+        log.log(500, {"request": b'{"a": 1}'}, path="/error")
+        log.stop()
+        entry, = self.read()
+        self.assertEqual(entry["path"], "/error")
+        self.assertEqual(entry["payload"], {"request": '{"a": 1}'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,22 @@
 """Тесты для модуля api.py"""
 
+import collections
 import datetime
 import functools
 import hashlib
+import http.client
+import json
+import threading
+import time
 import unittest
 
+from unittest import mock
+
 import api
-from store import KVStore
+import scoring
+import serializers
+import store as store_module
+from local_store import MemoryStore
 
 
 def cases(testcases):
@@ -22,6 +32,24 @@ def cases(testcases):
     return decorator
 
 
+class CountingStore:  # pylint: disable=too-few-public-methods  # методы берутся из store
+    """ Обертка хранилища, считающая вызовы его методов """
+
+    def __init__(self, store):
+        self.store = store
+        self.calls = collections.Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self.store, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            return attr(*args, **kwargs)
+        return call
+
+
 # @unittest.SkipTest
 class RequestsTestCase(unittest.TestCase):
     """ Тесты запросов к API """
@@ -30,12 +58,12 @@ class RequestsTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """ Настройка подключения и запись тестовых данных """
-        cls.store = KVStore(port=3301, host='localhost')
+        cls.store = MemoryStore()
         cls.store.set('i:1', [3, 4, 5])
 
     @classmethod
     def tearDownClass(cls):
-        cls.store.connection.close()
+        cls.store.close()
 
     def setUp(self):
         self.headers = {}
@@ -103,6 +131,47 @@ class RequestsTestCase(unittest.TestCase):
         self.assertEqual(response["score"], 42)
         self.assertEqual(self.context["has"], ["phone", "birthday", "gender"])
 
+    def test_online_score_batch_request(self):
+        """ Тестируем пакетный запрос скоринга с ошибкой в одном из элементов """
+        items = [{"phone": "79001234567", "email": "user@mail.ru"},
+                 {"phone": "79001234567"},
+                 {"first_name": "Jack", "last_name": "Smith"},
+                 {"phone": "79001234567", "email": "user@mail.ru"}]
+        request = {"method": "online_score_batch", "arguments": {"items": items}}
+        self.add_auth(request, "user")
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        scores = response["scores"]
+        self.assertEqual([item.get("score") for item in scores], [3.0, None, 0.5, 3.0])
+        self.assertEqual(scores[1]["code"], api.INVALID_REQUEST)
+        self.assertEqual(self.context["nitems"], 4)
+        self.assertEqual(self.store.cache_get_many(["uid:absent"]), {})
+
+    def test_online_score_batch_round_trips(self):
+        """ Пакет читает кеш одним cache_get_many и пишет не более одного cache_set_many """
+        items = [{"phone": f"7900123456{i}", "email": "user@mail.ru"} for i in range(5)]
+        request = {"method": "online_score_batch", "arguments": {"items": items}}
+        self.add_auth(request, "user")
+        store = CountingStore(MemoryStore())
+        for _ in range(2):  # второй раз все оценки уже в кеше
+            store.calls.clear()
+            response, code = api.method_handler({"body": request, "headers": {}}, {}, store)
+            self.assertEqual(api.OK, code)
+            self.assertEqual([item["score"] for item in response["scores"]], [3.0] * 5)
+            self.assertEqual(store.calls["cache_get_many"], 1)
+            self.assertLessEqual(store.calls["cache_set_many"], 1)
+            self.assertNotIn("cache_get", store.calls)
+            self.assertNotIn("cache_set", store.calls)
+        store.close()
+
+    @cases([{"items": []}, {"items": {}}, {"items": [{}] * (api.MAX_BATCH_SIZE + 1)}])
+    def test_online_score_batch_invalid(self, arguments):
+        """ Тестируем пакетный запрос с неверным списком аргументов """
+        request = {"method": "online_score_batch", "arguments": arguments}
+        self.add_auth(request, "user")
+        _, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code)
+
     @cases([{"client_ids": [1, 2, 3, 4, 5]},
            {"client_ids": [0]},
            {"client_ids": [3, 4, 5]}])
@@ -165,6 +234,241 @@ class FieldClassesTestCase(unittest.TestCase):
         api.BaseField(nullable=True).validate(value)
 
 
+class HTTPHandlerTestCase(unittest.TestCase):
+    """ Тесты HTTP обработчика на запущенном в потоке сервере """
+    server = None
+
+    @classmethod
+    def setUpClass(cls):
+        api.MainHTTPHandler.store = MemoryStore()
+        api.MainHTTPHandler.log_message = lambda *args: None
+        cls.server = api.ThreadingHTTPServer(("127.0.0.1", 0), api.MainHTTPHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def request(self, method, path, body=None):
+        """ HTTP запрос к серверу, возвращает статус и тело ответа """
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response.status, data
+
+    def test_method(self):
+        """ Запрос метода через HTTP """
+        request = {"method": "online_score", "arguments": {"first_name": "a", "last_name": "b"}}
+        RequestsTestCase.add_auth(request, "user")
+        status, data = self.request("POST", "/method/", json.dumps(request))
+        self.assertEqual(status, api.OK)
+        self.assertEqual(json.loads(data), {"response": {"score": 0.5}, "code": api.OK})
+
+    def test_metrics(self):
+        """ Метрики доступны только GET запросом и учитывают выполненные запросы """
+        self.request("POST", "/method/", json.dumps({"method": "online_score"}))
+        status, data = self.request("GET", "/metrics")
+        self.assertEqual(status, api.OK)
+        self.assertIn('scoring_requests_total{method="online_score",code="422"}', data.decode())
+        self.assertIn("scoring_request_duration_seconds_bucket", data.decode())
+        status, _ = self.request("GET", "/method/")
+        self.assertEqual(status, api.NOT_FOUND)
+        status, data = self.request("POST", "/metrics", json.dumps({"method": "metrics"}))
+        self.assertEqual(status, api.NOT_FOUND)
+        self.assertNotIn("scoring_requests_total", data.decode())
+
+    def test_overload(self):
+        """ При занятых слотах и полной очереди запрос сразу получает 503 """
+        admission = api.AdmissionControl(max_inflight=1, max_queue=0)
+        self.assertTrue(admission.acquire())
+        with mock.patch.object(api.MainHTTPHandler, "admission", admission):
+            status, data = self.request("POST", "/method/", json.dumps({}))
+        self.assertEqual(status, api.SERVICE_UNAVAILABLE)
+        self.assertEqual(json.loads(data)["code"], api.SERVICE_UNAVAILABLE)
+        self.assertEqual(admission.rejected, 1)
+        self.assertNotIn('method="rejected"', api.REGISTRY.render())
+
+    def test_deadline_exceeded(self):
+        """ Истекший во время обращения к хранилищу срок дает 503, а не 500 """
+        request = {"method": "clients_interests", "arguments": {"client_ids": [1, 2]}}
+        RequestsTestCase.add_auth(request, "user")
+        store = MemoryStore()
+        expired = store_module.DeadlineExceeded("expired")
+        with mock.patch.object(store, "get_many", side_effect=expired), \
+                mock.patch.object(api.MainHTTPHandler, "store", store):
+            status, data = self.request("POST", "/method/", json.dumps(request))
+        self.assertEqual(status, api.SERVICE_UNAVAILABLE)
+        self.assertEqual(json.loads(data)["code"], api.SERVICE_UNAVAILABLE)
+
+
+class AdmissionControlTestCase(unittest.TestCase):
+    """ Тесты ограничения числа одновременных запросов и срока обработки """
+
+    def test_queue(self):
+        """ Запрос ждет освобождения слота в очереди, сверх очереди - отказ """
+        admission = api.AdmissionControl(max_inflight=1, max_queue=1, queue_timeout=5)
+        self.assertTrue(admission.acquire())
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(admission.acquire()))
+        waiter.start()
+        while admission.waiting < 1:
+            time.sleep(0.001)
+        self.assertFalse(admission.acquire())
+        admission.release()
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertEqual((admission.inflight, admission.rejected), (1, 1))
+
+    def test_queue_timeout(self):
+        """ Запрос, не дождавшийся слота, отклоняется """
+        admission = api.AdmissionControl(max_inflight=1, max_queue=1, queue_timeout=0.01)
+        self.assertTrue(admission.acquire())
+        self.assertFalse(admission.acquire())
+        self.assertEqual(admission.waiting, 0)
+
+    def test_skip_cache_near_deadline(self):
+        """ Когда до срока запроса мало времени, скоринг считается без кеша """
+        store = MemoryStore()
+        key = scoring.score_key("79175002040")
+        store.cache_set(key, 100.0)
+        self.assertEqual(scoring.get_score(store, "79175002040", None), 100.0)
+        with store_module.deadline(scoring.CACHE_MIN_TIME / 2):
+            self.assertEqual(scoring.get_score(store, "79175002040", None), 1.5)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """ Тесты объединения одновременных вычислений """
+
+    def test_coalesced(self):
+        """ Одновременные вызовы с одним ключом получают результат одного вычисления """
+        flight = scoring.SingleFlight()
+        release = threading.Event()
+        computed = []
+
+        def compute():
+            computed.append(1)
+            release.wait(5)
+            return 4.5
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("uid:1", compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while flight.stats()["calls"] + flight.stats()["coalesced"] < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [4.5] * 5)
+        self.assertEqual(computed, [1])
+        self.assertEqual(flight.stats(), {"calls": 1, "coalesced": 4})
+
+    def test_error(self):
+        """ Ошибка вычисления получают все ожидающие, следующий вызов считает заново """
+        flight = scoring.SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do("uid:1", lambda: 1 / 0)
+        self.assertEqual(flight.do("uid:1", lambda: 1.5), 1.5)
+
+
+class KeyBatcherTestCase(unittest.TestCase):
+    """ Тесты объединения запросов ключей из хранилища """
+
+    class CountingStore(MemoryStore):
+        """ Хранилище, запоминающее пакетные запросы """
+        def __init__(self):
+            super().__init__()
+            self.lookups = []
+
+        def get_many(self, keys) -> dict:
+            self.lookups.append(set(keys))
+            return super().get_many(keys)
+
+    def test_batched(self):
+        """ Ключи одновременных вызовов запрашиваются одним get_many,
+        пачка отправляется до конца окна, когда набрано max_keys ключей """
+        store = self.CountingStore()
+        store.set_many({f"i:{cid}": [str(cid)] for cid in range(4)})
+        batcher = scoring.KeyBatcher(window=5, max_keys=4)
+        results = {}
+
+        def lookup(cid):
+            results[cid] = scoring.get_interests_many(store, [cid], batcher)
+
+        threads = [threading.Thread(target=lookup, args=(cid,)) for cid in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {cid: {cid: [str(cid)]} for cid in range(4)})
+        self.assertEqual(store.lookups, [{f"i:{cid}" for cid in range(4)}])
+        self.assertEqual(batcher.stats(), {"requests": 4, "batches": 1})
+
+    def test_unbatched(self):
+        """ Без окна каждый вызов запрашивает свои ключи, отсутствующие - пустой список """
+        store = self.CountingStore()
+        store.set("i:1", ["cars"])
+        batcher = scoring.KeyBatcher(window=0)
+        self.assertEqual(scoring.get_interests_many(store, [1, 2], batcher),
+                         {1: ["cars"], 2: []})
+        self.assertEqual(store.lookups, [{"i:1", "i:2"}])
+
+
+class SerializersTestCase(unittest.TestCase):
+    """ Тесты сериализаторов JSON """
+
+    def test_same_output(self):
+        """ Все сериализаторы дают одинаковый JSON для ответов API """
+        response = {"response": {1: ["cars", "pets"], 2: []}, "code": api.OK}
+        error = {"error": ValueError("Invalid method"), "code": api.INVALID_REQUEST}
+        for serializer in serializers.SERIALIZERS.values():
+            self.assertEqual(serializer.loads(serializer.dumps(response)),
+                             {"response": {"1": ["cars", "pets"], "2": []}, "code": api.OK})
+            self.assertEqual(serializer.loads(serializer.dumps(error))["error"],
+                             "Invalid method")
+
+    def test_unknown_serializer(self):
+        """ Запрос недоступного сериализатора """
+        with self.assertRaises(ValueError):
+            serializers.get_serializer("pickle")
+
+
+class AuthCacheTestCase(unittest.TestCase):
+    """ Тесты кеша аутентификации """
+
+    def setUp(self):
+        self.cache = api.AuthCache(maxsize=2)
+
+    @staticmethod
+    def admin_token(day: datetime.date) -> str:
+        """ Токен админа на заданный день """
+        return hashlib.sha512((day.strftime("%Y%m%d") + api.ADMIN_SALT).encode()).hexdigest()
+
+    def test_user_token(self):
+        """ Верный токен принимается и повторно, неверный отклоняется """
+        token = hashlib.sha512(("test" + "user" + api.SALT).encode()).hexdigest()
+        self.assertTrue(self.cache.check("test", "user", token, False))
+        self.assertTrue(self.cache.check("test", "user", token, False))
+        self.assertFalse(self.cache.check("test", "user", token[:-1], False))
+        self.assertFalse(self.cache.check("test2", "user", token, False))
+
+    def test_admin_token_expires_next_day(self):
+        """ Токен админа перестает действовать при смене суток, даже если закеширован """
+        today = datetime.date.today()
+        self.assertTrue(self.cache.check(None, api.ADMIN_LOGIN, self.admin_token(today), True))
+        tomorrow = time.time() + 24 * 60 * 60
+        with mock.patch("api.time.time", return_value=tomorrow):
+            self.assertFalse(self.cache.check(None, api.ADMIN_LOGIN,
+                                              self.admin_token(today), True))
+            next_day = today + datetime.timedelta(days=1)
+            self.assertTrue(self.cache.check(None, api.ADMIN_LOGIN,
+                                             self.admin_token(next_day), True))
+
+
 class RequestsClassesTestCase(unittest.TestCase):
     """ Тесты классов, задающих разные типы запросов """
 
@@ -172,7 +476,21 @@ class RequestsClassesTestCase(unittest.TestCase):
         """ Тест создания класса базового запроса """
         src_dict = {}
         req = api.BaseRequest(src_dict=src_dict)
-        self.assertEqual(src_dict, req.__dict__)
+        self.assertEqual(src_dict, req.to_dict())
+
+    def test_request_slots(self):
+        """ Поля собираются при создании класса, экземпляры хранят значения в слотах """
+        self.assertEqual(list(api.OnlineScoreRequest._fields),  # pylint: disable=protected-access
+                         ["first_name", "last_name", "email", "phone", "birthday", "gender"])
+        req = api.OnlineScoreRequest(src_dict={"phone": "79001234567"})
+        self.assertFalse(hasattr(req, "__dict__"))
+        self.assertEqual(req.phone, "79001234567")
+        self.assertIsNone(req.email)
+
+    def test_required_field(self):
+        """ Отсутствие обязательного поля """
+        with self.assertRaises(ValueError):
+            api.ClientsInterestsRequest(src_dict={"date": "01.01.2023"})
 
     def test_ClientsInterestsRequest(self):
         """ Тест создания класса запроса интересов """
@@ -0,0 +1,63 @@
+""" Тесты пакетной загрузки интересов клиентов """
+
+import json
+import os
+import tempfile
+import unittest
+
+from bulk_load import Checkpoint, load, read_batches, read_rows
+from local_store import MemoryStore
+
+
+class BulkLoadTestCase(unittest.TestCase):
+    """ Тесты чтения файла, контрольной точки и загрузки """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.checkpoint_path = os.path.join(self.tmpdir.name, "load.checkpoint")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, text):
+        """ Входной файл во временном каталоге """
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_read_rows(self):
+        """ Чтение csv и jsonl дает одинаковые строки """
+        csv_path = self.write("in.csv", "cid,interests\n1,cars;pets\n2,\n")
+        jsonl_path = self.write("in.jsonl", '{"cid": "1", "interests": ["cars", "pets"]}\n'
+                                            '{"cid": "2", "interests": []}\n')
+        expected = [("1", ["cars", "pets"]), ("2", [])]
+        self.assertEqual(list(read_rows(csv_path, "csv")), expected)
+        self.assertEqual(list(read_rows(jsonl_path, "jsonl")), expected)
+
+    def test_checkpoint_contiguous(self):
+        """ Отметка сдвигается только за непрерывно записанные пачки """
+        checkpoint = Checkpoint(self.checkpoint_path)
+        checkpoint.done(10, 20)
+        self.assertEqual(checkpoint.position, 0)
+        checkpoint.done(0, 10)
+        self.assertEqual(checkpoint.position, 20)
+        self.assertEqual(Checkpoint(self.checkpoint_path).position, 20)
+
+    def test_load_resume(self):
+        """ Загрузка с контрольной точки пропускает записанные строки """
+        rows = [(str(cid), ["cars"]) for cid in range(25)]
+        with open(self.checkpoint_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": 10}, f)
+        checkpoint = Checkpoint(self.checkpoint_path)
+        store = MemoryStore()
+        loaded = load(store, read_batches(rows, 4, checkpoint.position), checkpoint, 2)
+        self.assertEqual(loaded, 15)
+        self.assertEqual(checkpoint.position, 25)
+        self.assertIsNone(store.get("i:9"))
+        self.assertEqual(store.get("i:10"), ["cars"])
+        self.assertEqual(store.get("i:24"), ["cars"])
+
+
+if __name__ == "__main__":
+    unittest.main()
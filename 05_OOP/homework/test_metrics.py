@@ -0,0 +1,63 @@
+""" Тесты метрик, реализованных в metrics.py """
+
+import threading
+import unittest
+
+from metrics import Registry
+
+
+class MetricsTestCase(unittest.TestCase):
+    """ Тесты счетчиков, гистограмм и выдачи в формате Prometheus """
+
+    def setUp(self):
+        self.registry = Registry()
+        self.counter = self.registry.counter("requests_total", "Requests", ("method",))
+        self.histogram = self.registry.histogram("latency_seconds", "Latency", ("method",),
+                                                 buckets=(0.1, 1.0))
+
+    def test_counter(self):
+        """ Значения счетчика по меткам """
+        self.counter.inc("a")
+        self.counter.inc("a", value=2)
+        self.counter.inc("b")
+        text = self.registry.render()
+        self.assertIn('requests_total{method="a"} 3', text)
+        self.assertIn('requests_total{method="b"} 1', text)
+        self.assertIn("# TYPE requests_total counter", text)
+
+    def test_histogram(self):
+        """ Накопительные корзины, сумма и количество """
+        for value in (0.05, 0.5, 5):
+            self.histogram.observe(value, "a")
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{method="a",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{method="a",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{method="a",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_sum{method="a"} 5.55', text)
+        self.assertIn('latency_seconds_count{method="a"} 3', text)
+
+    def test_threads_merged(self):
+        """ Значения потоков, в том числе завершившихся, суммируются """
+        def work():
+            for _ in range(1000):
+                self.counter.inc("a")
+                self.histogram.observe(0.5, "a")
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.counter.inc("a")
+        values = self.registry.collect()
+        self.assertEqual(values[("requests_total", ("a",))], 8001)
+        self.assertEqual(values[("latency_seconds", ("a",))][-1], 8000)
+
+    def test_callback(self):
+        """ Метрика, вычисляемая при выдаче """
+        self.registry.callback("answer", "Answer", "gauge", lambda: 42)
+        self.assertIn("answer 42", self.registry.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
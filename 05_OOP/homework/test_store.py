@@ -1,8 +1,17 @@
 """ Интеграционные тесты работы с хранилищем tarantool, реализованной в store.py """
 
+import os
+import socket
+import tempfile
+import threading
+import time
 import unittest
 
-from store import KVStore
+import tarantool
+
+from local_store import MemoryStore, SQLiteStore
+from store import (ConnectionPool, DeadlineExceeded, HashRing, KVStore, PoolTimeoutError,
+                   WriteBehindBuffer, deadline, parse_hosts)
 
 
 class KVStoreTestCase(unittest.TestCase):
@@ -20,7 +29,7 @@ class KVStoreTestCase(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        cls.store.connection.close()
+        cls.store.close()
 
     def test_is_alive(self):
         """ Тестируем проверку подключения """
@@ -32,11 +41,278 @@ class KVStoreTestCase(unittest.TestCase):
         s = self.store.get(self.test_cid)
         self.assertEqual(s, [3, 4, 5])
 
+    def test_get_many(self):
+        """ Пакетный запрос тестовых данных """
+        s = self.store.get_many([self.test_cid, 'i:absent'])
+        self.assertEqual(s, {self.test_cid: [3, 4, 5]})
+
     def test_cache_get(self):
         """ Запрос тестовых данных из 'кеша' """
         s = self.store.cache_get(self.test_uid)
         self.assertEqual(s, 1.5)
 
+    def test_cache_get_many(self):
+        """ Пакетный запрос тестовых данных из 'кеша' """
+        self.store.cache_set_many({'uid:many1': 1.0, 'uid:many2': 2.0})
+        s = self.store.cache_get_many(['uid:many1', 'uid:many2', 'uid:absent'])
+        self.assertEqual(s, {'uid:many1': 1.0, 'uid:many2': 2.0})
+
+    def test_cache_get_expired(self):
+        """ Просроченное значение не возвращается из 'кеша' """
+        self.store.cache_set('uid:expired', 2.5, 0)
+        s = self.store.cache_get('uid:expired')
+        self.assertIsNone(s)
+
+
+class LocalStoreTestMixin:
+    """ Общие тесты локальных хранилищ """
+    store = None
+
+    def test_is_alive(self):
+        """ Локальное хранилище доступно """
+        self.assertTrue(self.store.is_alive)
+
+    def test_get_set(self):
+        """ Запись и чтение из хранилища """
+        self.store.set('i:123', ["cars", "pets"])
+        self.assertEqual(self.store.get('i:123'), ["cars", "pets"])
+        self.assertIsNone(self.store.get('i:absent'))
+
+    def test_set_many(self):
+        """ Пакетная запись в хранилище """
+        self.store.set_many({'i:1': ["cars"], 'i:2': ["pets", "tv"]})
+        self.assertEqual(self.store.get('i:1'), ["cars"])
+        self.assertEqual(self.store.get('i:2'), ["pets", "tv"])
+
+    def test_get_many(self):
+        """ Пакетный запрос из хранилища, в ответе только найденные ключи """
+        self.store.set_many({f'i:{cid}': [str(cid)] for cid in range(1200)})
+        keys = [f'i:{cid}' for cid in range(0, 1300, 2)]
+        self.assertEqual(self.store.get_many(keys),
+                         {f'i:{cid}': [str(cid)] for cid in range(0, 1200, 2)})
+        self.assertEqual(self.store.get_many([]), {})
+
+    def test_cache(self):
+        """ Запись в кеш, перезапись и истечение срока жизни """
+        self.store.cache_set('uid:1', 1.5)
+        self.assertEqual(self.store.cache_get('uid:1'), 1.5)
+        self.store.cache_set('uid:1', 3.0)
+        self.assertEqual(self.store.cache_get('uid:1'), 3.0)
+        self.store.cache_set('uid:1', 3.0, 0)
+        self.assertIsNone(self.store.cache_get('uid:1'))
+
+    def test_cache_many(self):
+        """ Пакетная запись и чтение из кеша """
+        self.store.cache_set_many({'uid:2': 1.5, 'uid:3': 2.0})
+        self.store.cache_set('uid:4', 3.0, 0)
+        self.assertEqual(self.store.cache_get_many(['uid:2', 'uid:3', 'uid:4', 'uid:5']),
+                         {'uid:2': 1.5, 'uid:3': 2.0})
+        self.assertEqual(self.store.cache_get_many([]), {})
+
+
+class MemoryStoreTestCase(LocalStoreTestMixin, unittest.TestCase):
+    """ Тесты хранилища в памяти """
+
+    def setUp(self):
+        self.store = MemoryStore(stripes=4)
+
+    def test_cache_size(self):
+        """ Размер кеша ограничен, вытесняются старые записи """
+        store = MemoryStore(stripes=4, cache_size=8)
+        for i in range(100):
+            store.cache_set(f'uid:{i}', float(i))
+        self.assertEqual(store.cache_get('uid:99'), 99.0)
+        self.assertIsNone(store.cache_get('uid:0'))
+
+
+class SQLiteStoreTestCase(LocalStoreTestMixin, unittest.TestCase):
+    """ Тесты хранилища в файле SQLite """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.store = SQLiteStore(os.path.join(self.tmpdir.name, "store.sqlite3"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_persistent(self):
+        """ Данные сохраняются между подключениями """
+        self.store.set('i:1', [1, 2])
+        self.store.close()
+        store = SQLiteStore(os.path.join(self.tmpdir.name, "store.sqlite3"))
+        self.assertEqual(store.get('i:1'), [1, 2])
+        store.close()
+
+    def test_thread_connections_closed(self):
+        """ Соединения завершившихся потоков закрываются и не накапливаются """
+        for _ in range(50):
+            thread = threading.Thread(target=self.store.get, args=('i:1',))
+            thread.start()
+            thread.join()
+        # pylint: disable=protected-access
+        self.assertEqual(len(self.store._connections), 1)  # соединение основного потока
+
+
+class FakeConnection:
+    """ Заглушка соединения для тестов пула """
+    closed = False
+
+    def __init__(self, calls=None):
+        self.calls = [] if calls is None else calls
+
+    def call(self, func_name, *args):
+        """ Вызов хранимой функции запоминается """
+        self.calls.append((func_name, *args))
+
+    def close(self):
+        """ Закрытие соединения """
+        self.closed = True
+
+
+class SlowConnection(FakeConnection):
+    """ Соединение, на котором запрос не успевает до таймаута сокета """
+
+    def __init__(self, calls=None):
+        super().__init__(calls)
+        self._socket = socket.socket()
+        self.timeouts = []
+
+    def select(self, *_):
+        """ Ждет таймаута сокета, как tarantool при молчащем сервере """
+        self.timeouts.append(self._socket.gettimeout())
+        time.sleep(self._socket.gettimeout())
+        raise tarantool.error.NetworkError(socket.timeout("timed out"))
+
+    def close(self):
+        super().close()
+        self._socket.close()
+
+
+class FakeConnectionPool(ConnectionPool):
+    """ Пул, не обращающийся к tarantool, вызовы всех соединений пишутся в calls """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+
+    def _connect(self):
+        return FakeConnection(self.calls)
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    """ Тесты пула соединений и распределения ключей по узлам """
+
+    def test_connection_reused(self):
+        """ Возвращенное в пул соединение выдается повторно """
+        pool = FakeConnectionPool(size=2)
+        with pool.connection() as conn:
+            first = conn
+        with pool.connection() as conn:
+            self.assertIs(conn, first)
+
+    def test_checkout_timeout(self):
+        """ Когда все соединения заняты, выдача завершается ошибкой по таймауту """
+        pool = FakeConnectionPool(size=1, checkout_timeout=0.01)
+        with pool.connection():
+            with self.assertRaises(PoolTimeoutError):
+                with pool.connection():
+                    pass
+        with pool.connection() as conn:
+            self.assertIsInstance(conn, FakeConnection)
+
+    def test_deadline(self):
+        """ Ожидание соединения ограничено сроком запроса, после срока соединение не выдается """
+        pool = FakeConnectionPool(size=1, checkout_timeout=5)
+        with pool.connection():
+            with deadline(0.01), self.assertRaises(PoolTimeoutError):
+                with pool.connection():
+                    pass
+        with deadline(-1), self.assertRaises(DeadlineExceeded):
+            with pool.connection():
+                pass
+        with deadline(None), pool.connection() as conn:
+            self.assertIsInstance(conn, FakeConnection)
+
+    def test_deadline_during_call(self):
+        """ Таймаут сокета, укороченный до срока запроса, дает DeadlineExceeded,
+        а соединение закрывается """
+        store = KVStore()
+        conn = SlowConnection()
+        store.pools[0]._connect = lambda: conn  # pylint: disable=protected-access
+        with deadline(0.01), self.assertRaises(DeadlineExceeded):
+            store.get("i:1")
+        self.assertLessEqual(conn.timeouts[0], 0.01)
+        self.assertTrue(conn.closed)
+        store.close()
+
+    def test_hash_ring_stable(self):
+        """ Ключ всегда попадает на один узел, ключи распределены по всем узлам """
+        ring = HashRing(["a", "b", "c"])
+        self.assertEqual(ring.get_node("uid:1"), ring.get_node("uid:1"))
+        nodes = {ring.get_node(f"i:{cid}") for cid in range(100)}
+        self.assertEqual(nodes, {"a", "b", "c"})
+
+    def test_hash_ring_remap(self):
+        """ При добавлении узла переезжает только часть ключей """
+        keys = [f"i:{cid}" for cid in range(1000)]
+        old, new = HashRing(["a", "b", "c"]), HashRing(["a", "b", "c", "d"])
+        moved = [key for key in keys if old.get_node(key) != new.get_node(key)]
+        self.assertTrue(all(new.get_node(key) == "d" for key in moved))
+        self.assertLess(len(moved), len(keys) / 2)
+
+    def test_parse_hosts(self):
+        """ Разбор списка узлов из командной строки """
+        self.assertEqual(parse_hosts("localhost:3301, 10.0.0.2:3302"),
+                         [("localhost", 3301), ("10.0.0.2", 3302)])
+
+
+class WriteBehindTestCase(unittest.TestCase):
+    """ Тесты отложенной записи в кеш """
+
+    def test_flush_on_close(self):
+        """ Записи из очереди записываются пачками, остаток - при закрытии """
+        store = KVStore(write_behind=True)
+        pool = store.pools[0] = FakeConnectionPool()
+        for i in range(10):
+            store.cache_set(f'uid:{i}', float(i), 60)
+        store.cache_set('uid:0', 100.0, 60)
+        store.close()
+        tuples = [item for call in pool.calls for item in call[2]]
+        self.assertTrue(all(call[:2] == ("kv_put_many", "test_scoring") for call in pool.calls))
+        self.assertEqual({key: value for key, value, _ in tuples}["uid:0"], 100.0)
+        self.assertEqual({key for key, _, _ in tuples}, {f'uid:{i}' for i in range(10)})
+
+    def test_drop_when_full(self):
+        """ При переполнении очереди записи отбрасываются, не блокируя вызывающего """
+        release = threading.Event()
+        flushed = []
+        buffer = WriteBehindBuffer(lambda batch: (release.wait(5), flushed.extend(batch)),
+                                   maxsize=2, interval=0.01)
+        results = [buffer.put(f'uid:{i}', 1.0, 0) for i in range(10)]
+        self.assertFalse(all(results))
+        self.assertGreater(buffer.dropped, 0)
+        release.set()
+        buffer.close()
+        self.assertEqual(len(flushed), results.count(True))
+
+    def test_dropped_concurrent(self):
+        """ Отброшенные записи разных потоков учитываются все """
+        release = threading.Event()
+        buffer = WriteBehindBuffer(lambda batch: release.wait(5), maxsize=1, interval=0.01)
+        results = []
+
+        def writer():
+            results.extend(buffer.put('uid:1', 1.0, 0) for _ in range(1000))
+
+        threads = [threading.Thread(target=writer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(buffer.dropped, results.count(False))
+        release.set()
+        buffer.close()
+
 
 if __name__ == '__main__':
     unittest.main()
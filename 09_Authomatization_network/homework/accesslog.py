@@ -0,0 +1,149 @@
+""" Журнал обращений к сервису в виде строк JSON.
+Обработчик запроса только кладет запись в очередь, форматирование
+и запись в файл выполняет поток QueueListener, который перезапускается
+в процессах-воркерах режима prefork """
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import weakref
+
+LOGGING_FORMAT = "[%(asctime)s] %(levelname).1s %(message)s"
+LOGGING_DATEFMT = "%Y.%m.%d %H:%M:%S"
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """ Передает записи в очередь без форматирования,
+    сообщение формирует поток QueueListener """
+
+    def prepare(self, record):
+        return record
+
+
+class AsyncQueueListener(logging.handlers.QueueListener):
+    """ QueueListener, который перезапускается в дочернем процессе после fork:
+    поток записи в дочерний процесс не копируется, и без перезапуска
+    записи оставались бы в очереди """
+
+    def __init__(self, queue_handler: logging.handlers.QueueHandler, *handlers):
+        super().__init__(queue_handler.queue, *handlers)
+        self.queue_handler = queue_handler
+
+    def start(self):
+        super().start()
+        _LISTENERS.add(self)
+
+    def stop(self):
+        _LISTENERS.discard(self)
+        super().stop()
+
+    def restart_in_child(self):
+        """ Новая очередь и поток записи в дочернем процессе """
+        self.queue = self.queue_handler.queue = queue.SimpleQueue()
+        self._thread = None
+        super().start()
+
+
+_LISTENERS = weakref.WeakSet()
+
+
+def _restart_listeners():
+    for listener in list(_LISTENERS):
+        listener.restart_in_child()
+
+
+def stop_listeners():
+    """ Запись оставшихся записей всех журналов процесса,
+    вызывается дочерним процессом перед os._exit """
+    for listener in list(_LISTENERS):
+        listener.stop()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listeners)
+
+
+def _default(obj):
+    """ bytes тела запроса выводятся текстом, прочие объекты - строкой """
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", "replace")
+    return str(obj)
+
+
+class JSONLineFormatter(logging.Formatter):
+    """ Запись журнала - компактная строка JSON с полями из record.access """
+
+    def format(self, record):
+        entry = {"time": round(record.created, 3)}
+        entry.update(record.access)
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def start_listener(logger: logging.Logger, handler: logging.Handler,
+                   level=logging.INFO) -> AsyncQueueListener:
+    """ Подключение к логгеру очереди, которую разбирает отдельный поток """
+    queue_handler = AsyncQueueHandler(queue.SimpleQueue())
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    listener = AsyncQueueListener(queue_handler, handler)
+    listener.start()
+    return listener
+
+
+def setup_logging(filename=None, level=logging.INFO) -> AsyncQueueListener:
+    """ Логирование через очередь: обработчики запросов только кладут запись
+    в очередь, форматирование и запись в файл выполняет отдельный поток """
+    handler = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOGGING_FORMAT, datefmt=LOGGING_DATEFMT))
+    return start_listener(logging.getLogger(), handler, level)
+
+
+class AccessLog:
+    """ Журнал обращений.
+    sample_rate - доля успешных обращений, попадающих в журнал,
+    ответы с кодом от 400 записываются всегда.
+    Тела запросов и ответов записываются только при debug = True """
+
+    def __init__(self, filename=None, sample_rate=1.0, debug=False, name="access"):
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.debug = debug
+        self.logger = logging.getLogger(name)
+        self.logger.propagate = False
+        self._listener = None
+
+    def start(self):
+        """ Запуск потока записи журнала """
+        if self.filename:
+            handler = logging.FileHandler(self.filename)
+        else:
+            handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JSONLineFormatter())
+        self._listener = start_listener(self.logger, handler)
+        return self
+
+    def stop(self):
+        """ Запись оставшихся записей и остановка потока """
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            for handler in self.logger.handlers[:]:
+                self.logger.removeHandler(handler)
+            self._listener = None
+
+    def log(self, status: int, payload=None, **fields):
+        """ Запись об обращении: код ответа и поля вроде method, path, duration_ms.
+        payload (тела запроса и ответа) попадает в журнал только в режиме debug """
+        if self._listener is None:
+            return
+        if status < 400 and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        fields["status"] = status
+        if self.debug and payload is not None:
+            fields["payload"] = payload
+        self.logger.info("", extra={"access": fields})
@@ -0,0 +1,136 @@
+""" Нагрузочный клиент для httpd.py, аналог ab для машин без ab/wrk
+
+python bench_httpd.py http://127.0.0.1:8080/index.html -n 50000 -c 100
+python bench_httpd.py http://127.0.0.1:8080/index.html -n 50000 -c 100 -k
+python bench_httpd.py http://127.0.0.1:8080/index.html -k -H 'If-None-Match: "5f3a-8e"'
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+class Stats:
+    """ Результаты запросов """
+
+    def __init__(self):
+        self.latencies = []
+        self.failed = 0
+        self.bytes = 0
+        self.codes = {}
+
+    def record(self, code: int, size: int, latency: float):
+        """ Учет выполненного запроса """
+        self.latencies.append(latency)
+        self.bytes += size
+        self.codes[code] = self.codes.get(code, 0) + 1
+
+    def fail(self):
+        """ Учет запроса, завершившегося ошибкой """
+        self.failed += 1
+
+
+async def read_response(reader: asyncio.StreamReader, keep_alive: bool):
+    """ Код ответа, длина тела и признак закрытия соединения сервером """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("iso-8859-1").split("\r\n")
+    code = int(lines[0].split(" ")[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length")
+    closed = not keep_alive or headers.get("connection", "").lower() == "close"
+    if code in (204, 304):
+        body = b""  # ответы без тела
+    elif length is not None:
+        body = await reader.readexactly(int(length))
+    else:
+        body = await reader.read()
+        closed = True
+    return code, len(head) + len(body), closed
+
+
+def build_request(url, keep_alive: bool, headers=()) -> bytes:
+    """ Байты запроса GET к url с дополнительными заголовками """
+    parts = urlsplit(url)
+    connection = "keep-alive" if keep_alive else "close"
+    extra = "".join(f"{header}\r\n" for header in headers)
+    return (f"GET {parts.path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+            f"Connection: {connection}\r\n{extra}\r\n").encode()
+
+
+async def client(url, requests: list, stats: Stats, keep_alive: bool, headers=()):
+    """ Последовательная отправка запросов, пока список не опустеет """
+    parts = urlsplit(url)
+    request = build_request(url, keep_alive, headers)
+    reader = writer = None
+    while requests:
+        requests.pop()
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            writer.write(request)
+            code, size, closed = await read_response(reader, keep_alive)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            stats.fail()
+            if writer is not None:
+                writer.close()
+            writer = None
+            continue
+        stats.record(code, size, time.perf_counter() - started)
+        if closed:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(params) -> Stats:
+    """ Запуск concurrency клиентов на общий список запросов """
+    stats = Stats()
+    requests = [None] * params.requests
+    await asyncio.gather(*(client(params.url, requests, stats, params.keep_alive, params.headers)
+                           for _ in range(params.concurrency)))
+    return stats
+
+
+def percentile(values: list, pct: float) -> float:
+    """ Перцентиль отсортированного списка """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    """ Запуск нагрузки и вывод результатов """
+    parser = argparse.ArgumentParser(description="HTTP benchmark")
+    parser.add_argument("url")
+    parser.add_argument("-n", dest="requests", default=10000, type=int)
+    parser.add_argument("-c", dest="concurrency", default=100, type=int)
+    parser.add_argument("-k", dest="keep_alive", action="store_true",
+                        help="reuse connections (HTTP keep-alive)")
+    parser.add_argument("-H", dest="headers", action="append", default=[],
+                        help="extra request header, e.g. 'Accept-Encoding: gzip'")
+    params = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = asyncio.run(run(params))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(stats.latencies)
+    print(f"Complete requests:   {len(latencies)}")
+    print(f"Failed requests:     {stats.failed}")
+    print(f"Status codes:        {stats.codes}")
+    print(f"Requests per second: {len(latencies) / elapsed:.2f}")
+    print(f"Transfer rate:       {stats.bytes / elapsed / 1024:.2f} Kbytes/sec")
+    for pct in (50, 90, 99, 100):
+        print(f"  {pct:>3}%  {percentile(latencies, pct) * 1000:8.2f} ms")
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
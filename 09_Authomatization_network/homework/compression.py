@@ -0,0 +1,136 @@
+""" Сжатие ответов httpd.py: выбор кодировки по Accept-Encoding и сжатие.
+brotli используется, если он установлен, gzip есть всегда.
+
+Запуск как скрипта заранее сжимает файлы DOCUMENT_ROOT, сервер отдает
+готовые файлы page.html.br и page.html.gz вместо сжатия на лету:
+
+python compression.py www --min-size 1024
+"""
+
+import argparse
+import gzip
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# кодировка -> расширение заранее сжатого файла, в порядке предпочтения сервера.
+# Готовые файлы .br отдаются и без установленного brotli
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+COMPRESSIBLE_TYPES = ("application/javascript", "application/x-javascript", "application/json",
+                      "application/xml", "image/svg+xml", "image/x-icon")
+
+
+def gzip_compress(data: bytes, best=False) -> bytes:
+    """ gzip без времени в заголовке: одинаковые файлы дают одинаковый результат """
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+def brotli_compress(data: bytes, best=False) -> bytes:
+    """ brotli, на лету с быстрым уровнем сжатия """
+    return brotli.compress(data, quality=11 if best else 5)
+
+
+COMPRESSORS = {"gzip": gzip_compress}
+if brotli is not None:
+    COMPRESSORS["br"] = brotli_compress
+
+
+def is_compressible(mime: str) -> bool:
+    """ Текстовые типы хорошо сжимаются, картинки и архивы - нет """
+    return mime.startswith("text/") or mime in COMPRESSIBLE_TYPES
+
+
+def negotiate(accept_encoding: bytes, available) -> list:
+    """ Кодировки из available, допустимые по Accept-Encoding: по убыванию q,
+    при равном q - в порядке available. * означает любую не указанную кодировку """
+    weights = {}
+    for item in accept_encoding.lower().split(b","):
+        name, _, params = item.partition(b";")
+        name = name.strip().decode("ascii", "replace")
+        weight = 1.0
+        for param in params.split(b";"):
+            key, _, value = param.partition(b"=")
+            if key.strip() == b"q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name] = weight
+    default = weights.get("*", 0.0)
+    chosen = [(weights.get(name, default), index, name) for index, name in enumerate(available)]
+    return [name for weight, _, name in sorted(chosen, key=lambda c: (-c[0], c[1])) if weight > 0]
+
+
+def candidates(root: str, min_size: int):
+    """ Файлы дерева root, которые стоит сжимать: текстовые, не меньше min_size байт
+    и не сами готовые варианты. Пары (путь, stat) """
+    extensions = tuple(ENCODINGS.values())
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            mime, _ = mimetypes.guess_type(path)
+            if name.endswith(extensions) or mime is None or not is_compressible(mime):
+                continue
+            st = os.stat(path)
+            if st.st_size >= min_size:
+                yield path, st
+
+
+def write_variant(target: str, data: bytes, encoding: str, best: bool) -> int:
+    """ Сжатый вариант пишется во временный файл и заменяет target целиком.
+    Возвращает его размер, 0 - если сжатие не уменьшает размер и файл не записан """
+    compressed = COMPRESSORS[encoding](data, best)
+    if len(compressed) >= len(data):
+        return 0
+    tmp = target + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp, target)
+    return len(compressed)
+
+
+def precompress(root: str, min_size=1024, encodings=None, best=True) -> tuple:
+    """ Сжатие файлов дерева root рядом с исходными.
+    Файл пропускается, если готовый вариант новее исходного, и не пишется,
+    если сжатие не уменьшает размер. Возвращает число файлов, байты до и после """
+    encodings = [name for name in encodings or COMPRESSORS if name in COMPRESSORS]
+    count = before = after = 0
+    for path, st in candidates(root, min_size):
+        with open(path, "rb") as f:
+            data = f.read()
+        for encoding in encodings:
+            target = path + ENCODINGS[encoding]
+            if os.path.exists(target) and os.stat(target).st_mtime_ns >= st.st_mtime_ns:
+                continue
+            size = write_variant(target, data, encoding, best)
+            if size:
+                count += 1
+                before += len(data)
+                after += size
+    return count, before, after
+
+
+def main():
+    """ Сжатие файлов DOCUMENT_ROOT """
+    parser = argparse.ArgumentParser(description="Precompress static files for httpd.py")
+    parser.add_argument("root", help="DOCUMENT_ROOT directory")
+    parser.add_argument("--min-size", dest="min_size", default=1024, type=int,
+                        help="smaller files are not compressed, bytes")
+    parser.add_argument("--encodings", nargs="+", default=None, choices=list(ENCODINGS),
+                        help="gzip and br (if brotli is installed) by default")
+    params = parser.parse_args()
+    missing = set(params.encodings or ()) - set(COMPRESSORS)
+    if missing:
+        parser.error(f"not available: {', '.join(sorted(missing))}, install brotli")
+    count, before, after = precompress(params.root, params.min_size, params.encodings)
+    print(f"{count} files written, {before} -> {after} bytes")
+
+
+if __name__ == "__main__":
+    main()
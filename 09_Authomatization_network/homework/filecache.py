@@ -0,0 +1,107 @@
+""" Кэш файлов httpd.py в памяти """
+
+import os
+import stat
+import threading
+import time
+
+from collections import OrderedDict
+
+from headers import entity_headers, mime_type
+
+
+def make_etag(st: os.stat_result, encoding="") -> bytes:
+    """ ETag файла из времени изменения и размера, без чтения содержимого.
+    У сжатых вариантов свой ETag с названием кодировки """
+    if encoding:
+        return b'"%x-%x-%s"' % (st.st_mtime_ns // 1000, st.st_size, encoding.encode("ascii"))
+    return b'"%x-%x"' % (st.st_mtime_ns // 1000, st.st_size)
+
+
+class CachedFile:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """ Файл в кэше: содержимое, тип и данные для проверки актуальности.
+    Для сжатого на лету варианта data - сжатые байты, а path и st - исходного файла """
+    __slots__ = ("path", "data", "mime", "headers", "etag", "mtime", "size", "checked")
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, path: str, data: bytes, st: os.stat_result, mime=None, encoding=""):
+        self.path = path
+        self.data = data
+        self.mime = mime or mime_type(path)
+        self.headers = entity_headers(self.mime, len(data))
+        self.etag = make_etag(st, encoding)  # считается один раз на версию файла в кэше
+        self.mtime = st.st_mtime_ns
+        self.size = st.st_size
+        self.checked = time.monotonic()
+
+
+class FileCache:
+    """ LRU кэш файлов в памяти по пути запроса, общий размер ограничен max_bytes.
+    Запись сверяется с файлом (mtime и размер) не чаще раза в check_interval секунд,
+    в остальное время файл отдается без обращений к файловой системе.
+    Файлы больше max_file не кэшируются и отправляются через sendfile """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, max_file=2 ** 20, check_interval=1.0):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.check_interval = check_interval
+        self.size = 0
+        self._files = OrderedDict()
+        self._lock = threading.Lock()  # воркеры-потоки делят кэш
+
+    def get(self, key: str):
+        """ Файл из кэша или None, если его нет или он изменился """
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is None:
+                return None
+            self._files.move_to_end(key)
+        now = time.monotonic()
+        if now - entry.checked < self.check_interval:
+            return entry
+        try:
+            st = os.stat(entry.path)
+        except OSError:
+            st = None
+        if st is None or st.st_mtime_ns != entry.mtime or st.st_size != entry.size:
+            self.discard(key)
+            return None
+        entry.checked = now
+        return entry
+
+    def fits(self, size: int) -> bool:
+        """ Файл такого размера может храниться в кэше """
+        return size <= min(self.max_file, self.max_bytes) and self.max_bytes > 0
+
+    def load(self, key: str, path: str, mime=None, encoding=""):
+        """ Чтение файла в кэш. None, если файл слишком большой для кэша """
+        if not self.max_bytes:
+            return None
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode) or not self.fits(st.st_size):
+                return None
+            entry = CachedFile(path, f.read(), st, mime, encoding)
+        return self.put(key, entry)
+
+    def put(self, key: str, entry: CachedFile):
+        """ Добавление записи, давно не запрошенные файлы вытесняются """
+        if not self.fits(len(entry.data)):
+            return None
+        with self._lock:
+            old = self._files.pop(key, None)
+            if old is not None:
+                self.size -= len(old.data)
+            self._files[key] = entry
+            self.size += len(entry.data)
+            while self.size > self.max_bytes:
+                _, evicted = self._files.popitem(last=False)
+                self.size -= len(evicted.data)
+        return entry
+
+    def discard(self, key: str):
+        """ Удаление файла из кэша """
+        with self._lock:
+            entry = self._files.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry.data)
@@ -0,0 +1,128 @@
+""" Заголовки ответов httpd.py: коды ответа, страницы ошибок
+и неизменные фрагменты заголовков, собранные один раз при импорте """
+
+import functools
+import mimetypes
+import os
+import time
+
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+
+from compression import ENCODINGS
+
+OK = 200
+PARTIAL_CONTENT = 206
+NOT_MODIFIED = 304
+NOT_FOUND = 404
+FORBIDDEN = 403
+BAD_REQUEST = 400
+NOT_ALLOWED = 405
+CONTENT_TOO_LARGE = 413
+RANGE_NOT_SATISFIABLE = 416
+HEADERS_TOO_LARGE = 431
+INTERNAL_SERVER_ERROR = 500
+HTTP_VERSION_NOT_SUPPORTED = 505
+MESSAGES = {
+    OK: "OK",
+    PARTIAL_CONTENT: "PARTIAL_CONTENT",
+    NOT_MODIFIED: "NOT_MODIFIED",
+    NOT_FOUND: "NOT_FOUND",
+    FORBIDDEN: "FORBIDDEN",
+    BAD_REQUEST: "BAD_REQUEST",
+    NOT_ALLOWED: "NOT_ALLOWED",
+    CONTENT_TOO_LARGE: "CONTENT_TOO_LARGE",
+    RANGE_NOT_SATISFIABLE: "RANGE_NOT_SATISFIABLE",
+    HEADERS_TOO_LARGE: "REQUEST_HEADER_FIELDS_TOO_LARGE",
+    INTERNAL_SERVER_ERROR: "INTERNAL_SERVER_ERROR",
+    HTTP_VERSION_NOT_SUPPORTED: "HTTP_VERSION_NOT_SUPPORTED"
+}
+HTML_ERROR = """<html>
+<head>
+<meta charset="UTF-8"> 
+<title>{status} - {text}</title>
+</head>
+<body>
+<h1>Error loading page</h1>
+<h2>{status}</h2>
+<p>{text}</p>
+</body>
+</html>
+"""
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+# Неизменные части заголовков ответа собираются один раз
+STATUS_LINES = {status: f"HTTP/1.1 {status} {text}\r\n".encode("utf-8")
+                for status, text in MESSAGES.items()}
+SERVER_HEADER = b"Server: Otus homework web server\r\n"
+CONNECTION_HEADERS = {True: b"Connection: keep-alive\r\n", False: b"Connection: close\r\n"}
+ACCEPT_RANGES = b"Accept-Ranges: bytes\r\n"
+VARY_HEADERS = {True: b"Vary: Accept-Encoding\r\n", False: b""}
+ENCODING_HEADERS = {encoding: f"Content-Encoding: {encoding}\r\n".encode("ascii")
+                    for encoding in ENCODINGS}
+ENCODING_HEADERS[""] = b""
+
+
+def _error_page(status: int) -> tuple:
+    body = HTML_ERROR.format(status=status, text=MESSAGES[status]).encode("utf-8")
+    headers = b"Content-Type: text/html; charset=utf-8\r\nContent-Length: %d\r\n" % len(body)
+    return body, headers
+
+
+ERROR_PAGES = {status: _error_page(status) for status in MESSAGES if status >= 400}
+
+
+def mime_type(path: str) -> str:
+    """ MIME тип по расширению файла """
+    _, extension = os.path.splitext(path)
+    return mimetypes.types_map.get(extension, DEFAULT_CONTENT_TYPE)
+
+
+@functools.lru_cache(maxsize=None)
+def content_type_header(mime: str) -> bytes:
+    """ Строка заголовка Content-Type, одна на каждый MIME тип """
+    return f"Content-Type: {mime}\r\n".encode("utf-8")
+
+
+def entity_headers(mime: str, length: int) -> bytes:
+    """ Заголовки Content-Type и Content-Length """
+    return content_type_header(mime) + b"Content-Length: %d\r\n" % length
+
+
+def parse_http_date(value: bytes):
+    """ Дата из заголовка запроса как timestamp, None для некорректной даты """
+    try:
+        date = parsedate_to_datetime(value.decode("iso-8859-1"))
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+@functools.lru_cache(maxsize=4096)
+def validator_headers(etag: bytes, mtime: int) -> bytes:
+    """ Заголовки ETag и Last-Modified, форматируются один раз на версию файла """
+    return b"ETag: %s\r\nLast-Modified: %s\r\n" % (
+        etag, formatdate(mtime, usegmt=True).encode("ascii"))
+
+
+# состояние - последняя отформатированная секунда, нужен только get
+class HttpDate:  # pylint: disable=too-few-public-methods
+    """ Значение заголовка Date. Форматируется не чаще раза в секунду,
+    остальные запросы этой секунды получают готовые байты """
+
+    def __init__(self):
+        self._second = None
+        self._value = b""
+
+    def get(self) -> bytes:
+        """ Текущая дата в формате HTTP """
+        now = int(time.time())
+        if now != self._second:
+            self._value = formatdate(now, usegmt=True).encode("ascii")
+            self._second = now  # после _value: увидевший новую секунду получит новое значение
+        return self._value
+
+
+HTTP_DATE = HttpDate()
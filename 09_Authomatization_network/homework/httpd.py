@@ -1,127 +1,470 @@
 """ Модуль реализует web server c многопоточной архитектурой """
 
 import argparse
+import functools
 import logging
-import mimetypes
 import os
-
+import selectors
+import signal
+import socket as socket_module
+import stat
 import threading
 import time
 
-from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from socket import (socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP,
+                    TCP_NODELAY)
 from urllib.parse import unquote
 
+from accesslog import AccessLog, setup_logging, stop_listeners
+from compression import COMPRESSORS, ENCODINGS, is_compressible, negotiate
+from filecache import CachedFile, FileCache, make_etag
+from headers import (OK, PARTIAL_CONTENT, NOT_MODIFIED, NOT_FOUND, FORBIDDEN, BAD_REQUEST,
+                     NOT_ALLOWED, CONTENT_TOO_LARGE, RANGE_NOT_SATISFIABLE, HEADERS_TOO_LARGE,
+                     INTERNAL_SERVER_ERROR, DEFAULT_CONTENT_TYPE, STATUS_LINES, SERVER_HEADER,
+                     CONNECTION_HEADERS, ACCEPT_RANGES, VARY_HEADERS, ENCODING_HEADERS,
+                     ERROR_PAGES, HTTP_DATE, entity_headers, mime_type, parse_http_date,
+                     validator_headers)
+from ranges import content_range, multipart_body, parse_ranges
 
-LOGGING_FORMAT = "[%(asctime)s] %(levelname).1s %(message)s"
-LOGGING_DATEFMT = "%Y.%m.%d %H:%M:%S"
 LOGGING_LEVEL = logging.INFO
 
-LOGGING_FILE = None
-
-logging.basicConfig(filename=LOGGING_FILE, level=LOGGING_LEVEL,
-                    format=LOGGING_FORMAT, datefmt=LOGGING_DATEFMT)
-
 HOST = "127.0.0.1"
 PORT = 80
 DOCUMENT_ROOT = "09_Authomatization_network\\homework\\www"
 INDEX = "index.html"
 ENCODING = "utf-8"
 
-OK = 200
-NOT_FOUND = 404
-FORBIDDEN = 403
-BAD_REQUEST = 400
-NOT_ALLOWED = 405
-INTERNAL_SERVER_ERROR = 500
-HTTP_VERSION_NOT_SUPPORTED = 505
-MESSAGES = {
-    OK: "OK",
-    NOT_FOUND: "NOT_FOUND",
-    FORBIDDEN: "FORBIDDEN",
-    BAD_REQUEST: "BAD_REQUEST",
-    NOT_ALLOWED: "NOT_ALLOWED",
-    INTERNAL_SERVER_ERROR: "INTERNAL_SERVER_ERROR",
-    HTTP_VERSION_NOT_SUPPORTED: "HTTP_VERSION_NOT_SUPPORTED"
-}
-HTML_ERROR = """<html>
-<head>
-<meta charset="UTF-8"> 
-<title>{status} - {text}</title>
-</head>
-<body>
-<h1>Error loading page</h1>
-<h2>{status}</h2>
-<p>{text}</p>
-</body>
-</html>
-"""
-
-
-class EchoServer:
+
+# состояние запроса и ответа - набор слотов без поведения
+class Request:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """ Запрос одного клиента и подготовленный ответ.
+    Создается на каждый запрос, поэтому потоки не делят состояние """
+    __slots__ = ("method", "path", "head", "status", "keep_alive", "response",
+                 "response_headers", "response_body", "content_length", "file", "file_offset",
+                 "file_size", "cached", "mime", "encoding", "vary", "etag", "mtime", "ranges",
+                 "range_headers")
+
+    def __init__(self, keep_alive=False):
+        self.method = ""
+        self.path = ""
+        self.head = b""  # строка запроса и заголовки
+        self.status = 0
+        self.keep_alive = keep_alive  # соединение остается открытым после ответа
+        self.response = b""  # заголовки и тело страницы ошибки, отправляются первыми
+        self.response_headers = b""
+        self.response_body = b""
+        self.content_length = 0  # размер отдаваемого файла
+        self.file = None  # открытый файл, отправляется после заголовков
+        self.file_offset = 0  # с какого байта и сколько байт файла отправить
+        self.file_size = 0
+        self.cached = None  # CachedFile, если файл отдается из кэша
+        self.mime = DEFAULT_CONTENT_TYPE
+        self.encoding = ""  # Content-Encoding сжатого варианта файла
+        self.vary = False  # ответ зависит от Accept-Encoding
+        self.etag = b""
+        self.mtime = 0  # время изменения файла, секунды
+        self.ranges = []  # запрошенные диапазоны байт для ответа 206
+        self.range_headers = b""  # Content-Type, Content-Length и Content-Range ответа 206
+
+
+NO_RESPONSE = memoryview(b"")  # the connection waits for the next request
+
+
+class Connection:  # pylint: disable=too-many-instance-attributes
+    """ State of a client connection in the event loop mode:
+    request bytes are read until complete, then the response is written
+    and the file body, if any, is streamed after it. Keep-alive connections
+    then go on with the next (possibly already received) request """
+    __slots__ = ("sock", "address", "data", "response", "sent", "file", "file_offset",
+                 "file_left", "keep_alive", "served", "started", "last_active")
+    file_chunk = 65536  # read size for file bodies where os.sendfile is not available
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.data = bytearray()
+        self.response = NO_RESPONSE  # memoryview of the response while writing
+        self.sent = 0
+        self.file = None  # open file streamed after the response
+        self.file_offset = 0
+        self.file_left = 0
+        self.keep_alive = False
+        self.served = 0  # requests answered on this connection
+        self.started = self.last_active = time.perf_counter()
+
+    def write(self) -> bool:
+        """ Send the response, then the file body; True once everything is sent """
+        try:
+            if self.sent < len(self.response):
+                self.sent += self.sock.send(self.response[self.sent:])
+            if self.sent >= len(self.response) and self.file_left:
+                self.send_file()
+        except (BlockingIOError, InterruptedError):
+            return False
+        self.last_active = time.perf_counter()
+        return self.sent >= len(self.response) and not self.file_left
+
+    def send_file(self):
+        """ Send the next part of the file body: os.sendfile copies it
+        from the page cache to the socket without reading into Python """
+        if hasattr(os, "sendfile"):
+            sent = os.sendfile(self.sock.fileno(), self.file.fileno(), self.file_offset,
+                               self.file_left)
+        else:
+            self.file.seek(self.file_offset)
+            sent = self.sock.send(self.file.read(min(self.file_left, self.file_chunk)))
+        if not sent:
+            raise ConnectionError("File was truncated while sending")
+        self.file_offset += sent
+        self.file_left -= sent
+
+    def close(self, selector):
+        """ Unregister and close the connection """
+        selector.unregister(self.sock)
+        self.sock.close()
+        if self.file is not None:
+            self.file.close()
+
+
+# settings, sockets and worker bookkeeping of the server
+class EchoServer:  # pylint: disable=too-many-instance-attributes
     """ Base class TCP Echo Server """
-    def __init__(self, host: str, port: int, workers: int, stop_event: threading.Event):
+    modes = ("threads", "epoll", "prefork")
+    backlog = 128
+    read_size = 1024
+    client_timeout = 1.0  # seconds a client may stay silent
+    keepalive_timeout = 5.0  # seconds a keep-alive connection may wait for the next request
+    max_requests = 100  # requests per keep-alive connection
+    restart_delay = 1.0  # pause before restarting a worker process that died right after start
+    # prefork: every worker process listens on its own socket, the kernel balances connections
+    reuse_port = hasattr(socket_module, "SO_REUSEPORT")
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, host: str, port: int, workers: int, stop_event: threading.Event,
+                 mode="threads"):
         self.address = (host, port)
-        self.read_size = 1024
         self.workers = workers
+        self.mode = mode
         self.opened_threads = []
         self.sock: socket = None
         self.stop_event = stop_event
+        self.access_log = AccessLog()  # не пишет, пока не вызван start()
+        self.processes = {}  # pid -> (worker key, start time), prefork mode
+
+    def bind(self, address, reuse_port=False) -> socket:
+        """ Open a socket bound to the address """
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(SOL_SOCKET, socket_module.SO_REUSEPORT, 1)
+        try:
+            sock.bind(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
 
     def start(self):
-        """ Try to open the socket and start server threads"""
-        self.sock = socket(AF_INET, SOCK_STREAM)
-        self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        """ Try to open the socket and start server threads or processes """
+        if self.mode == "prefork" and not hasattr(os, "fork"):
+            logging.warning("prefork mode needs os.fork, using epoll worker threads instead")
+            self.mode = "epoll"
+        prefork_reuse_port = self.mode == "prefork" and self.reuse_port
         try:
             logging.info("Starting HTTP server on %s...", self.address)
-            self.sock.bind(self.address)
+            self.sock = self.bind(self.address, prefork_reuse_port)
         except OSError:
             logging.exception("Failed to bind socket")
             return
-        logging.info("Listening port %s", str(self.address[1]))
+        if not prefork_reuse_port:
+            # with SO_REUSEPORT the master only holds the port, workers listen themselves
+            self.sock.listen(self.backlog)
+        logging.info("Listening port %s", str(self.sock.getsockname()[1]))
         logging.info("Press Ctrl+C to shut down the server and exit.")
+        if self.mode == "prefork":
+            for key in range(self.workers):
+                self.fork_worker(key)
+            t = threading.Thread(target=self.supervise, name="supervisor")
+            t.start()
+            self.opened_threads.append(t)
+            return
+        target = self.serve_events if self.mode == "epoll" else self.listen
         for key in range(self.workers):
-            logging.info("Starting worker thread %s", key)
-            t = threading.Thread(target=self.listen, args=(key,))
+            logging.info("Starting worker thread %s (%s)", key, self.mode)
+            t = threading.Thread(target=target, args=(key,))
             t.start()
             self.opened_threads.append(t)
         logging.debug("All threads started")
 
     def listen(self, worker_key):
         """ Listen to incoming connections """
-        self.sock.listen(5)
         self.sock.settimeout(1)
         while not self.stop_event.is_set():
             # logging.debug("Worker %s: accepting connections", worker_key)
             try:
-                client, _ = self.sock.accept()
-                client.settimeout(1)
-                self.serve_client(client, worker_key)
+                client, address = self.sock.accept()
+                client.settimeout(self.client_timeout)
+                client.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+                self.serve_client(client, worker_key, address)
             except OSError:
                 pass  # timeout expired
 
-    def serve_client(self, client, worker_key):
-        """ Responding to client request """
+    def serve_events(self, worker_key):
+        """ Event loop over non-blocking sockets (epoll on Linux).
+        Every worker thread has its own selector and accepts
+        from the shared listening socket """
+        self.sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        swept = time.perf_counter()
+        stop_at = None
         try:
-            data = self.read(client)
-            logging.debug("Worker %s received: %s", worker_key, data)
-            if data:
-                response = self.get_response(data)
-                client.sendall(response)
-                logging.debug("Worker %s has sent response %s", worker_key, response)
-                client.close()
+            while True:
+                if self.stop_event.is_set() and stop_at is None:
+                    # graceful stop: no new connections, started responses are finished
+                    selector.unregister(self.sock)
+                    stop_at = time.perf_counter() + self.client_timeout
+                    self.close_idle(selector, time.perf_counter(), stopping=True)
+                if stop_at is not None and (not selector.get_map()
+                                            or time.perf_counter() > stop_at):
+                    break
+                for key, mask in selector.select(timeout=1 if stop_at is None else 0.1):
+                    self.handle_event(selector, key, mask, worker_key)
+                now = time.perf_counter()
+                if now - swept >= 1:
+                    self.close_idle(selector, now)
+                    swept = now
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.data is not None:
+                    key.data.sock.close()
+            selector.close()
+            logging.debug("Worker %s: event loop stopped", worker_key)
+
+    def handle_event(self, selector, key, mask, worker_key):
+        """ Accept, read or write for one ready socket. An unexpected error
+        closes only the connection it happened on, the event loop goes on """
+        try:
+            if key.data is None:
+                self.accept(selector)
+            elif mask & selectors.EVENT_READ:
+                self.on_read(selector, key.data)
             else:
-                logging.debug("Worker %s: Client disconnected", worker_key)
+                self.on_write(selector, key.data)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception("Worker %s: unexpected error serving client", worker_key)
+            if key.data is not None and key.data.sock in selector.get_map():
+                key.data.close(selector)
+
+    def fork_worker(self, key):
+        """ Start a worker process with its own event loop """
+        pid = os.fork()
+        if pid:
+            self.processes[pid] = (key, time.monotonic())
+            logging.info("Started worker process %s (pid %s)", key, pid)
+            return
+        code = 0
+        try:
+            self.run_worker(key)
+        except BaseException:  # pylint: disable=broad-exception-caught
+            logging.exception("Worker process %s failed", key)
+            code = 1
+        finally:
+            stop_listeners()
+            os._exit(code)  # pylint: disable=protected-access
+
+    def run_worker(self, key):
+        """ Body of a worker process: stops on SIGTERM, Ctrl+C is handled by the master """
+        self.stop_event = threading.Event()
+        self.processes = {}
+        signal.signal(signal.SIGTERM, lambda *_: self.stop_event.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.reuse_port:
+            address = self.sock.getsockname()
+            self.sock.close()
+            self.sock = self.bind(address, reuse_port=True)
+            self.sock.listen(self.backlog)
+        self.serve_events(key)
+
+    def supervise(self):
+        """ Wait for worker processes and restart the ones that died """
+        while self.processes:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                return
+            except InterruptedError:
+                continue
+            key, started = self.processes.pop(pid, (None, 0))
+            if key is None or self.stop_event.is_set():
+                continue
+            logging.error("Worker process %s (pid %s) exited with status %s, restarting",
+                          key, pid, status)
+            if time.monotonic() - started < self.restart_delay:
+                # do not spin on a worker that fails right after start
+                self.stop_event.wait(self.restart_delay)
+            if not self.stop_event.is_set():
+                self.fork_worker(key)
+
+    def accept(self, selector):
+        """ Accept all pending connections """
+        while True:
+            try:
+                client, address = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return  # connection was taken by another worker or no more pending
+            client.setblocking(False)
+            # headers and file body are separate writes: without TCP_NODELAY the body of
+            # a keep-alive response waits for the delayed ACK of the headers
+            client.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            selector.register(client, selectors.EVENT_READ, Connection(client, address))
+
+    def on_read(self, selector, conn: Connection):
+        """ Read available request bytes, respond once a request is complete """
+        try:
+            chunk = conn.sock.recv(self.read_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            conn.close(selector)
+            return
+        if not chunk:
+            conn.close(selector)
+            return
+        conn.data += chunk
+        conn.last_active = time.perf_counter()
+        self.process(selector, conn)
+
+    def process(self, selector, conn: Connection):
+        """ Respond to the complete requests in the buffer one after another,
+        so pipelined requests get their responses in order """
+        while True:
+            size = self.request_size(conn.data)
+            if not size:
+                selector.modify(conn.sock, selectors.EVENT_READ, conn)
+                return
+            data = bytes(conn.data[:size])
+            del conn.data[:size]
+            conn.served += 1
+            last = conn.served >= self.max_requests or self.stop_event.is_set()
+            request = self.respond(data, conn.started, conn.address, last)
+            conn.response = memoryview(request.response)
+            conn.sent = 0
+            conn.file, conn.file_offset = request.file, request.file_offset
+            conn.file_left = request.file_size
+            conn.keep_alive = request.keep_alive
+            try:
+                done = conn.write()  # usually the socket buffer has room right away
+            except OSError:
+                conn.close(selector)
+                return
+            if not done:
+                selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+                return
+            if not self.finish(selector, conn):
+                return
+
+    def on_write(self, selector, conn: Connection):
+        """ Write as much of the response as the socket accepts """
+        try:
+            done = conn.write()
+        except OSError:
+            conn.close(selector)
+            return
+        if done and self.finish(selector, conn):
+            self.process(selector, conn)
+
+    def finish(self, selector, conn: Connection) -> bool:
+        """ The response is sent: close the connection or prepare it for the next request.
+        Returns True if the connection stays open """
+        if conn.file is not None:
+            conn.file.close()
+            conn.file = None
+        if not conn.keep_alive:
+            conn.close(selector)
+            return False
+        conn.response = NO_RESPONSE
+        conn.started = time.perf_counter()
+        return True
+
+    def close_idle(self, selector, now, stopping=False):
+        """ Close connections silent for longer than client_timeout,
+        keep-alive connections waiting for the next request - after keepalive_timeout.
+        When the server stops, connections without a request in progress are closed at once """
+        for key in list(selector.get_map().values()):
+            conn = key.data
+            if conn is None:
+                continue
+            waiting = not conn.response and not conn.data
+            timeout = self.keepalive_timeout if waiting and conn.served else self.client_timeout
+            if (stopping and waiting) or now - conn.last_active > timeout:
+                conn.close(selector)
+
+    def request_size(self, data: bytes) -> int:
+        """ Length of the first complete request in data, 0 if it is not complete yet.
+        Any data is a complete echo request """
+        return len(data)
+
+    def serve_client(self, client, worker_key, address=None):
+        """ Responding to client requests until the connection is closed """
+        data = bytearray()
+        served = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                size = self.read(client, data)
+                if not size:
+                    logging.debug("Worker %s: Client disconnected", worker_key)
+                    break
+                request_data = bytes(data[:size])
+                del data[:size]
+                served += 1
+                last = served >= self.max_requests or self.stop_event.is_set()
+                request = self.respond(request_data, started, address, last)
+                try:
+                    client.sendall(request.response)
+                    if request.file is not None:
+                        client.sendfile(request.file, request.file_offset, request.file_size)
+                finally:
+                    if request.file is not None:
+                        request.file.close()
+                if not request.keep_alive:
+                    break
+                client.settimeout(self.keepalive_timeout)
         except TimeoutError:
-            logging.info("Worker %s: timed out waiting for request", worker_key)
-            client.close()
+            if served and not data:
+                logging.debug("Worker %s: keep-alive connection idle, closing", worker_key)
+            else:
+                logging.info("Worker %s: timed out waiting for request", worker_key)
         except OSError:
             logging.exception("Error serving client in worker thread %s", worker_key)
-            client.close()
-
-    def read(self, client):
-        """ Receive data from socket"""
-        data = client.recv(self.read_size)
-        return data
+        except Exception:  # pylint: disable=broad-exception-caught
+            # an unexpected error closes only this connection, the worker goes on
+            logging.exception("Unexpected error serving client in worker thread %s", worker_key)
+        client.close()
+
+    def respond(self, data: bytes, started: float, address=None, last=False) -> Request:
+        """ Response to a complete request, written to the access log.
+        last - the connection is closed after this response """
+        request = Request(keep_alive=not last)
+        request.response = self.get_response(data)
+        self.access_log.log(0, {"request": data, "response": request.response},
+                            client=address[0] if address else None,
+                            bytes=len(request.response),
+                            duration_ms=round((time.perf_counter() - started) * 1000, 3))
+        return request
+
+    def read(self, client, data: bytearray) -> int:
+        """ Receive data from socket until data holds a complete request.
+        Returns its size, 0 if the client closed the connection first """
+        size = self.request_size(data)
+        while not size:
+            chunk = client.recv(self.read_size)
+            if not chunk:
+                return 0  # клиент закрыл соединение, неполный запрос отбрасывается
+            data += chunk
+            size = self.request_size(data)
+        return size
 
     def get_response(self, data: bytes) -> bytes:
         """ Simple version returning echo response """
@@ -131,6 +474,11 @@ class EchoServer:
         """ Stop all threads and close the socket """
         try:
             logging.info("Shutting down the server")
+            for pid in list(self.processes):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass  # already exited, reaped by the supervisor
             for th in self.opened_threads:
                 th.join(timeout=2)
                 logging.debug("Joined thread %s", th.name)
@@ -138,111 +486,366 @@ class EchoServer:
             logging.exception("Could not shut down the socket. Maybe it was already closed")
 
 
-class HTTPServer(EchoServer):
+class HTTPServer(EchoServer):  # pylint: disable=too-many-instance-attributes
     """ Added methods to read and parse requests, prepare and send responses """
     maxsize = 65536
     supported_methods = ("GET", "HEAD")
+    max_ranges = 16  # больше диапазонов в Range - заголовок игнорируется
+    max_multipart = 2 ** 20  # ответ на несколько диапазонов собирается в памяти до этого размера
+    compress = True  # сжатие текстовых файлов по Accept-Encoding
+    compress_min_size = 1024  # файлы меньше этого размера не сжимаются
 
     # pylint: disable=too-many-arguments
-    def __init__(self, host, port, workers, stop_event, document_root):
-        super().__init__(host, port, workers, stop_event)
-        self.method = ""
-        self.path = ""
-        self.status = 0
-        self.document_root = document_root
-        self.response_headers = b"empty_header"  # for debug
-        self.response_body = b"empty_body"
-
-    def read(self, client):
-        data = bytearray()
-        while b"\r\n\r\n" not in data:
-            data += client.recv(self.read_size)
-            if not data or len(data) > self.maxsize:
-                self.status = BAD_REQUEST
-                break
-        return data
-
-    def get_response(self, data: bytes) -> bytes:
-        if self.parse_request(data):
-            self.analyze_request()
-        if self.status == OK and self.method == "GET":
-            self.get_html_file()
-        logging.debug("Preparing headers... Status=%s", self.status)
-        self.get_response_headers()
-        if self.method == "GET":
-            return self.response_headers + self.response_body + b"\r\n\r\n"
-        return self.response_headers  # HEAD request
-
-    def parse_request(self, data: bytes) -> bool:
+    def __init__(self, host, port, workers, stop_event, document_root, mode="threads"):
+        super().__init__(host, port, workers, stop_event, mode)
+        self.root = os.path.abspath(document_root)
+        self.file_cache = FileCache()
+        self.cache_control = b""  # готовая строка заголовка Cache-Control, пусто - не отправлять
+
+    def respond(self, data: bytes, started: float, address=None, last=False) -> Request:
+        request = Request(keep_alive=not last)
+        try:
+            request.response = self.get_response(data, request)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception("Unexpected error processing request")
+            if request.file is not None:
+                request.file.close()
+            request = self.internal_error()
+        request_line = bytes(data.split(b"\r\n", 1)[0]).decode("iso-8859-1")
+        payload = {"request": data, "response": request.response_headers}
+        self.access_log.log(request.status, payload, client=address[0] if address else None,
+                            request=request_line,
+                            bytes=len(request.response) + request.file_size,
+                            duration_ms=round((time.perf_counter() - started) * 1000, 3))
+        return request
+
+    def internal_error(self) -> Request:
+        """ Ответ 500 на запрос, обработка которого завершилась непредвиденной ошибкой.
+        Соединение закрывается: неизвестно, в каком состоянии остался запрос """
+        request = Request()
+        request.status = INTERNAL_SERVER_ERROR
+        self.get_response_headers(request)
+        request.response = request.response_headers + request.response_body
+        return request
+
+    def request_size(self, data: bytes) -> int:
+        """ Длина первого запроса в data: заголовки и тело длиной Content-Length.
+        Непрочитанное тело при закрытии сокета приводит к RST, и клиент
+        может не получить ответ, а при keep-alive тело приняли бы за следующий запрос.
+        Если заголовки превышают допустимый размер, запросом считается весь буфер.
+        Такой запрос получает ответ too_large, после которого соединение закрывается """
+        end = data.find(b"\r\n\r\n")
+        if end < 0:
+            return len(data) if len(data) > self.maxsize else 0
+        size = end + 4 + self.content_length(data[:end])
+        if size > self.maxsize:
+            return end + 4  # тело не ждем, соединение закроется после ответа 413
+        return size if len(data) >= size else 0
+
+    def too_large(self, data: bytes) -> int:
+        """ Код ответа на запрос больше maxsize, 0 - запрос допустимого размера.
+        Непрочитанный остаток такого запроса нельзя разбирать как следующий запрос """
+        end = data.find(b"\r\n\r\n")
+        if end < 0:
+            return HEADERS_TOO_LARGE if len(data) > self.maxsize else 0
+        if end + 4 > self.maxsize:
+            return HEADERS_TOO_LARGE
+        if end + 4 + self.content_length(data[:end]) > self.maxsize:
+            return CONTENT_TOO_LARGE
+        return 0
+
+    @staticmethod
+    def header(head: bytes, name: bytes) -> bytes:
+        """ Значение заголовка запроса, name - в нижнем регистре """
+        for line in bytes(head).split(b"\r\n")[1:]:
+            key, _, value = line.partition(b":")
+            if key.strip().lower() == name:
+                return value.strip()
+        return b""
+
+    @classmethod
+    def content_length(cls, head: bytes) -> int:
+        """ Длина тела запроса из заголовка Content-Length """
+        try:
+            return max(int(cls.header(head, b"content-length") or 0), 0)
+        except ValueError:
+            return 0
+
+    def get_response(self, data: bytes, request: Request = None) -> bytes:
+        """ Заголовки ответа и тело страницы ошибки.
+        Тело файла не читается: request.file отправляется после заголовков """
+        request = Request() if request is None else request
+        status = self.too_large(data)
+        if status:
+            logging.error("Request is larger than %d bytes, answering %d", self.maxsize, status)
+            request.status, request.keep_alive = status, False
+        elif self.parse_request(data, request):
+            self.analyze_request(request)
+        if request.status in (OK, PARTIAL_CONTENT) and request.method == "GET":
+            if request.cached is not None:
+                request.response_body = request.cached.data
+            else:
+                self.get_html_file(request)
+            if request.status == PARTIAL_CONTENT:
+                self.get_ranges(request)
+        self.get_response_headers(request)
+        if request.method == "HEAD":
+            return request.response_headers
+        return request.response_headers + request.response_body
+
+    def parse_request(self, data: bytes, request: Request) -> bool:
         """ Парсинг запроса """
         request_str = data.decode("iso-8859-1")
         try:
             request_str, _ = request_str.split("\r\n", maxsplit=1)
-            method, path, protocol = request_str.strip().split(" ")
+            method, path, version = request_str.strip().split(" ")
         except ValueError:
             logging.error("Unable to parse request headers '%s'", request_str)
-            self.status = BAD_REQUEST
+            request.status = BAD_REQUEST
+            request.keep_alive = False
             return False
-        self.method = method.upper()
+        request.method = method.upper()
+        request.head = data.split(b"\r\n\r\n", 1)[0]
+        # HTTP/1.1 держит соединение, пока не попросят закрыть, HTTP/1.0 - только по просьбе
+        connection = {token.strip() for token in
+                      self.header(request.head, b"connection").lower().split(b",")}
+        if version.upper() == "HTTP/1.0":
+            request.keep_alive = request.keep_alive and b"keep-alive" in connection
+        else:
+            request.keep_alive = request.keep_alive and b"close" not in connection
         path = unquote(path)
         if "?" in path:
             path, _ = path.split('?', maxsplit=1)
-        self.path = os.path.join(os.path.abspath(os.getcwd()),
-                                 self.document_root,
-                                 path.lstrip("/"))
-        logging.debug("Path %s", self.path)
-        logging.debug("Parsed request method=%s, path=%s, protocol=%s",
-                     self.method, self.path, protocol)
+        if "\0" in path:
+            logging.error("NUL byte in path: %r", path)
+            request.status = BAD_REQUEST
+            return False
+        request.path = os.path.join(self.root, path.lstrip("/"))
+        if os.path.commonpath([self.root, os.path.normpath(request.path)]) != self.root:
+            logging.error("Path outside of document root: %s", path)
+            request.status = FORBIDDEN
+            return False
         return True
 
-    def analyze_request(self):
+    def analyze_request(self, request: Request):
         """ Подготовка ответа """
-        if self.method not in self.supported_methods:
-            logging.error("Method not supported: %s", self.method)
-            self.status = NOT_ALLOWED
+        if request.method not in self.supported_methods:
+            logging.error("Method not supported: %s", request.method)
+            request.status = NOT_ALLOWED
+            return
+        key = request.path
+        request.cached = self.file_cache.get(key)
+        st = None
+        if request.cached is None:
+            st = self.stat_file(request)
+            if st is None:
+                request.status = NOT_FOUND
+                return
+            try:
+                request.cached = self.file_cache.load(key, request.path)
+            except OSError:
+                logging.exception("Error reading file %s", request.path)
+                request.status = INTERNAL_SERVER_ERROR
+                return
+        if request.cached is not None:
+            request.mime = request.cached.mime
         else:
-            if os.path.isdir(self.path):
-                logging.debug("Found requested dir")
-                self.path = os.path.join(self.path, INDEX)
-            if os.path.isfile(self.path):
-                logging.debug("Found requested file")
-                self.status = OK
+            request.mime = mime_type(request.path)
+        if self.compress and is_compressible(request.mime):
+            st = self.select_encoding(request, key, st)
+        if request.cached is not None:
+            request.path = request.cached.path
+            request.content_length = len(request.cached.data)
+            request.etag = request.cached.etag
+            request.mtime = request.cached.mtime // 10 ** 9
+        else:
+            request.content_length = st.st_size
+            request.etag = make_etag(st, request.encoding)
+            request.mtime = int(st.st_mtime)
+        request.status = NOT_MODIFIED if self.not_modified(request) else OK
+        if request.status == OK and request.method == "GET":
+            self.analyze_range(request)
+
+    @staticmethod
+    def stat_file(request: Request):
+        """ stat файла запроса, для директории - ее индексного файла.
+        None, если файла нет """
+        try:
+            st = os.stat(request.path)
+            if stat.S_ISDIR(st.st_mode):
+                request.path = os.path.join(request.path, INDEX)
+                st = os.stat(request.path)
+        except (OSError, ValueError):  # ValueError - NUL в пути
+            return None
+        return st if stat.S_ISREG(st.st_mode) else None
+
+    def select_encoding(self, request: Request, key: str, st):
+        """ Сжатый вариант файла по Accept-Encoding: готовый файл рядом с исходным
+        (page.html.gz) или сжатый на лету и сохраненный в кэше. Возвращает stat
+        файла для отправки sendfile, если вариант не помещается в кэш.
+        Части файла (Range) отдаются без сжатия """
+        request.vary = True
+        accept = self.header(request.head, b"accept-encoding")
+        if not accept or self.header(request.head, b"range"):
+            return st
+        if request.cached is not None:
+            path, size, mtime = request.cached.path, request.cached.size, request.cached.mtime
+        else:
+            path, size, mtime = request.path, st.st_size, st.st_mtime_ns
+        if size < self.compress_min_size:
+            return st
+        for encoding in negotiate(accept, ENCODINGS):
+            variant_key = f"{key}\0{encoding}"
+            cached = self.file_cache.get(variant_key)
+            if cached is not None and cached.mtime < mtime:  # исходный файл новее готового
+                self.file_cache.discard(variant_key)
+                cached = None
+            if cached is None:
+                sibling = path + ENCODINGS[encoding]
+                sibling_st = self.stat_sibling(sibling, mtime)
+                if sibling_st is not None:
+                    cached = self.file_cache.load(variant_key, sibling, request.mime, encoding)
+                    if cached is None:
+                        request.cached, request.path, request.encoding = None, sibling, encoding
+                        return sibling_st
+                elif encoding in COMPRESSORS and self.file_cache.fits(size):
+                    cached = self.compress_file(variant_key, path, request.mime, encoding)
+            if cached is not None:
+                request.cached, request.encoding = cached, encoding
+                return st
+        return st
+
+    @staticmethod
+    def stat_sibling(path: str, mtime: int):
+        """ stat заранее сжатого файла, None - если его нет или он старше исходного """
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        return st if stat.S_ISREG(st.st_mode) and st.st_mtime_ns >= mtime else None
+
+    def compress_file(self, key: str, path: str, mime: str, encoding: str):
+        """ Сжатие файла на лету, результат хранится в кэше под своим ключом
+        и сверяется с исходным файлом по mtime и размеру. None, если сжатие
+        не уменьшает размер """
+        try:
+            with open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                data = f.read()
+        except OSError:
+            return None
+        compressed = COMPRESSORS[encoding](data)
+        if len(compressed) >= len(data):
+            return None
+        return self.file_cache.put(key, CachedFile(path, compressed, st, mime, encoding))
+
+    def not_modified(self, request: Request) -> bool:
+        """ Условный запрос, и у клиента актуальная версия файла.
+        If-None-Match проверяется первым, If-Modified-Since - только без него """
+        if_none_match = self.header(request.head, b"if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix(b"W/") for tag in if_none_match.split(b",")}
+            return b"*" in tags or request.etag in tags
+        if_modified_since = self.header(request.head, b"if-modified-since")
+        since = parse_http_date(if_modified_since) if if_modified_since else None
+        return since is not None and request.mtime <= since
+
+    def analyze_range(self, request: Request):
+        """ Запрос части файла: 206 для выполнимых диапазонов, 416 - если
+        ни один не попадает в файл. Некорректный Range, слишком много диапазонов
+        или устаревший If-Range - файл отдается целиком """
+        value = self.header(request.head, b"range")
+        if not value or not self.if_range(request):
+            return
+        ranges = parse_ranges(value, request.content_length)
+        if ranges is None or len(ranges) > self.max_ranges:
+            return
+        if len(ranges) > 1 and sum(end - start + 1 for start, end in ranges) > self.max_multipart:
+            return
+        request.ranges = ranges
+        request.status = PARTIAL_CONTENT if ranges else RANGE_NOT_SATISFIABLE
+
+    def if_range(self, request: Request) -> bool:
+        """ If-Range: диапазон отдается, только если файл не изменился """
+        value = self.header(request.head, b"if-range")
+        if not value:
+            return True
+        if value.startswith(b'"') or value.startswith(b"W/"):
+            return value == request.etag  # слабый ETag не совпадает ни с чем
+        return parse_http_date(value) == request.mtime
+
+    def get_ranges(self, request: Request):
+        """ Тело ответа 206. Один диапазон из файла на диске отправляется
+        sendfile со смещения, несколько собираются в multipart/byteranges """
+        mime = request.mime
+        size = request.content_length
+        if len(request.ranges) == 1:
+            (start, end), = request.ranges
+            if request.file is not None:
+                request.file_offset, request.file_size = start, end - start + 1
             else:
-                self.status = NOT_FOUND
-        logging.debug("Analyzed request. Status=%s", self.status)
-
-    def get_html_file(self) :
-        """ Read file for GET request """
-        logging.debug("Reading file...Status=%s", self.status)
+                request.response_body = request.response_body[start:end + 1]
+            request.range_headers = entity_headers(mime, end - start + 1) + \
+                content_range(start, end, size)
+            return
+        request.response_body, request.range_headers = multipart_body(
+            request.ranges, functools.partial(self.read_range, request), mime, size)
+        if request.file is not None:
+            request.file.close()
+            request.file, request.file_size = None, 0
+
+    @staticmethod
+    def read_range(request: Request, start: int, end: int) -> bytes:
+        """ Байты диапазона из кэша или из открытого файла """
+        if request.file is None:
+            return request.response_body[start:end + 1]
+        request.file.seek(start)
+        return request.file.read(end - start + 1)
+
+    def get_html_file(self, request: Request):
+        """ Open file for GET request, its size is taken from the open descriptor,
+        so Content-Length matches the bytes sent even if the file is replaced """
         try:
-            with open(self.path, "rb") as f:
-                self.response_body = f.read()
+            request.file = open(request.path, "rb")  # pylint: disable=consider-using-with
+            st = os.fstat(request.file.fileno())
+            request.file_size = request.content_length = st.st_size
+            request.etag, request.mtime = make_etag(st, request.encoding), int(st.st_mtime)
         except OSError:
-            logging.exception("Error reading file %s", self.path)
-            self.status = INTERNAL_SERVER_ERROR
-
-    def get_response_headers(self):
-        """ Упаковка заголовков ответа для отправки """
-        response_headers = {
-            "Date": time.strftime("%a, %d %b %Y %H:%M:%S", time.localtime()),
-            "Server": "Otus homework web server",
-            "Connection": "close",
-            "Content-Type": "text/html; charset='utf8'",
-            "Content-Length": 0
-        }
-        message = MESSAGES.get(self.status)
-        if self.status != OK:
-            self.response_body = HTML_ERROR.format(status=self.status,
-                                                   text=message).encode("utf-8")
+            logging.exception("Error reading file %s", request.path)
+            request.status = INTERNAL_SERVER_ERROR
+            if request.file is not None:
+                request.file.close()
+                request.file = None
+
+    def get_response_headers(self, request: Request):
+        """ Упаковка заголовков ответа для отправки: готовые фрагменты
+        для кода ответа, типа файла и соединения соединяются одним join """
+        validators = b""
+        if request.status in ERROR_PAGES:
+            request.response_body, entity = ERROR_PAGES[request.status]
+            if request.status == RANGE_NOT_SATISFIABLE:
+                entity += b"Content-Range: bytes */%d\r\n" % request.content_length
         else:
-            response_headers["Content-Length"] = os.path.getsize(self.path)
-            _, extension = os.path.splitext(self.path)
-            response_headers["Content-Type"] = mimetypes.types_map.get(extension)
-        headers = f"HTTP/1.1 {self.status} {message}\r\n"
-        for name, value in response_headers.items():
-            headers += f"{name}: {value}\r\n"
-        headers += "\r\n"
-        self.response_headers = headers.encode("utf-8")
+            if request.status == NOT_MODIFIED:
+                entity = b""  # 304 без тела
+            elif request.status == PARTIAL_CONTENT:
+                entity = request.range_headers
+            elif request.cached is not None:
+                entity = request.cached.headers
+            else:
+                entity = entity_headers(request.mime, request.content_length)
+            validators = b"".join((ACCEPT_RANGES, validator_headers(request.etag, request.mtime),
+                                   ENCODING_HEADERS[request.encoding], VARY_HEADERS[request.vary],
+                                   self.cache_control))
+        request.response_headers = b"".join((
+            STATUS_LINES[request.status],
+            b"Date: ", HTTP_DATE.get(), b"\r\n",
+            SERVER_HEADER,
+            CONNECTION_HEADERS[request.keep_alive],
+            entity,
+            validators,
+            b"\r\n",
+        ))
 
 
 def get_params() -> argparse.Namespace:
@@ -251,7 +854,36 @@ def get_params() -> argparse.Namespace:
     parser.add_argument("--ip", "-i", default=HOST, type=str)
     parser.add_argument("--port", "-p", default=PORT, type=int)
     parser.add_argument("--workers", "-w", default=10, type=int)
+    parser.add_argument("--mode", "-m", default="threads", choices=HTTPServer.modes,
+                        help="threads: one blocking connection per thread, "
+                             "epoll: event loop over non-blocking sockets in every worker, "
+                             "prefork: worker processes with event loops, uses all cores")
     parser.add_argument("--documentroot", "-r", default=DOCUMENT_ROOT)
+    parser.add_argument("--keepalive-timeout", dest="keepalive_timeout",
+                        default=EchoServer.keepalive_timeout, type=float,
+                        help="seconds a keep-alive connection may wait for the next request")
+    parser.add_argument("--max-requests", dest="max_requests", default=EchoServer.max_requests,
+                        type=int, help="requests per keep-alive connection, 1 disables keep-alive")
+    parser.add_argument("--cache-size", dest="cache_size", default=64, type=float,
+                        help="in-memory file cache size, MB, 0 disables the cache")
+    parser.add_argument("--cache-max-file", dest="cache_max_file", default=1024, type=float,
+                        help="larger files are not cached but sent with sendfile, KB")
+    parser.add_argument("--cache-check", dest="cache_check", default=1.0, type=float,
+                        help="seconds between checks of a cached file modification time")
+    parser.add_argument("--cache-control", dest="cache_control", default="",
+                        help="Cache-Control header for files, e.g. 'public, max-age=3600'")
+    parser.add_argument("--compress-min-size", dest="compress_min_size",
+                        default=HTTPServer.compress_min_size, type=int,
+                        help="smaller files are sent uncompressed, bytes")
+    parser.add_argument("--no-compress", dest="compress", action="store_false",
+                        help="ignore Accept-Encoding and precompressed .gz/.br files")
+    parser.add_argument("--log", "-l", default=None, help="log file, stderr by default")
+    parser.add_argument("--access-log", dest="access_log", default=None,
+                        help="JSON lines access log file, stdout by default")
+    parser.add_argument("--access-log-sample", dest="access_log_sample", default=1.0,
+                        type=float, help="share of successful requests written to access log")
+    parser.add_argument("--log-payload", dest="log_payload", action="store_true",
+                        help="write requests and response headers to access log")
     args = parser.parse_args()
     return args
 
@@ -259,21 +891,38 @@ def get_params() -> argparse.Namespace:
 def main():
     """ Get parameters and start server """
     params = get_params()
+    log_listener = setup_logging(params.log, LOGGING_LEVEL)
     stop_event = threading.Event()
-    server = HTTPServer(params.ip, params.port, params.workers, stop_event, params.documentroot)
+    server = HTTPServer(params.ip, params.port, params.workers, stop_event, params.documentroot,
+                        params.mode)
+    server.keepalive_timeout = params.keepalive_timeout
+    server.max_requests = max(params.max_requests, 1)
+    server.file_cache = FileCache(int(params.cache_size * 2 ** 20),
+                                  int(params.cache_max_file * 2 ** 10), params.cache_check)
+    server.compress = params.compress
+    server.compress_min_size = params.compress_min_size
+    if params.cache_control:
+        server.cache_control = f"Cache-Control: {params.cache_control}\r\n".encode("utf-8")
+    server.access_log = AccessLog(params.access_log, params.access_log_sample,
+                                  params.log_payload).start()
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
     try:
         server.start()
         while not stop_event.is_set():
             time.sleep(0.5)
             # logging.debug("Main thread")
+        logging.info("SIGTERM received")
     except KeyboardInterrupt:
         logging.debug("KeyboardInterrupt signal received!")
         stop_event.set()
-        time.sleep(0.5)
-        server.shutdown()
         logging.info("Server was stopped by user")
     except:  # pylint: disable=bare-except
         logging.exception("Unexpected error")
+        stop_event.set()
+    server.shutdown()
+    server.access_log.stop()
+    log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+""" Ответы на запросы части файла (Range, 206): разбор диапазонов
+и сборка тела multipart/byteranges """
+
+import os
+
+from headers import content_type_header, entity_headers
+
+
+def parse_ranges(value: bytes, size: int):
+    """ Диапазоны байт из заголовка Range: список пар (начало, конец включительно).
+    None - заголовок некорректен и игнорируется, пустой список - ни один диапазон
+    не попадает в файл (416) """
+    unit, _, spec = value.partition(b"=")
+    if unit.strip().lower() != b"bytes":
+        return None
+    ranges = []
+    for part in spec.split(b","):
+        first, dash, last = part.strip().partition(b"-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start, end = int(first), int(last) if last.strip() else None
+            else:
+                suffix = int(last)  # последние suffix байт
+                if suffix < 0:
+                    return None
+                if not suffix:
+                    continue
+                start, end = max(size - suffix, 0), None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    return ranges
+
+
+def content_range(start: int, end: int, size: int) -> bytes:
+    """ Строка заголовка Content-Range для диапазона """
+    return b"Content-Range: bytes %d-%d/%d\r\n" % (start, end, size)
+
+
+def multipart_body(ranges: list, read, mime: str, size: int) -> tuple:
+    """ Тело multipart/byteranges для нескольких диапазонов, read(start, end) -
+    байты диапазона. Возвращает тело и заголовки Content-Type и Content-Length """
+    boundary = os.urandom(8).hex().encode("ascii")
+    parts = []
+    for start, end in ranges:
+        parts.append(b"--%s\r\n%s%s\r\n" % (
+            boundary, content_type_header(mime), content_range(start, end, size)))
+        parts.append(read(start, end))
+        parts.append(b"\r\n")
+    parts.append(b"--%s--\r\n" % boundary)
+    body = b"".join(parts)
+    headers = entity_headers("multipart/byteranges; boundary=" + boundary.decode("ascii"),
+                             len(body))
+    return body, headers
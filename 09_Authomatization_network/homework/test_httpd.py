@@ -1,7 +1,508 @@
 """Тесты для модуля httpd.py """
 
+import gzip
+import http.client
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import quote
 
+import compression
+from headers import HttpDate
+import httpd
 
-class HttpdTestCase(unittest.TestCase):
+DOCUMENT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "www")
+
+
+# проверки живого сервера, общие для всех режимов: подклассы меняют только mode
+class HttpdTestCase(unittest.TestCase):  # pylint: disable=too-many-public-methods
     """ Тестирование функций веб сервера """
+    mode = "threads"
+    workers = 2
+    server = None
+    stop_event = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stop_event = threading.Event()
+        cls.server = httpd.HTTPServer("127.0.0.1", 0, cls.workers, cls.stop_event,
+                                      DOCUMENT_ROOT, cls.mode)
+        # файлы больше 200 КБ (jquery, wikipedia_russia.html) отдаются через sendfile
+        cls.server.file_cache = httpd.FileCache(max_file=200 * 2 ** 10)
+        cls.server.start()
+        cls.port = cls.server.sock.getsockname()[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stop_event.set()
+        cls.server.shutdown()
+        cls.server.sock.close()
+
+    def request(self, method, path, headers=None):
+        """ HTTP запрос к серверу, возвращает ответ и тело """
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response, body
+
+    def test_get(self):
+        """ Файл отдается с верными заголовками """
+        response, body = self.request("GET", "/httptest/dir2/page.html")
+        self.assertEqual(response.status, httpd.OK)
+        self.assertEqual(int(response.getheader("Content-Length")), len(body))
+        self.assertEqual(response.getheader("Content-Type"), "text/html")
+        self.assertTrue(response.getheader("Date").endswith(" GMT"))
+        self.assertIn(b"<html>", body)
+
+    def test_not_found(self):
+        """ Отсутствующий файл - 404 """
+        response, _ = self.request("GET", "/httptest/absent.html")
+        self.assertEqual(response.status, httpd.NOT_FOUND)
+
+    def test_head(self):
+        """ HEAD возвращает заголовки без тела """
+        response, body = self.request("HEAD", "/httptest/dir2/page.html")
+        self.assertEqual(response.status, httpd.OK)
+        self.assertEqual(body, b"")
+
+    def test_large_file(self):
+        """ Тело файла отправляется целиком и без лишних байт после него """
+        with open(os.path.join(DOCUMENT_ROOT, "httptest/wikipedia_russia.html"), "rb") as f:
+            expected = f.read()
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(b"GET /httptest/wikipedia_russia.html HTTP/1.1\r\n"
+                         b"Connection: close\r\n\r\n")
+            head, body = self.read_all(sock).split(b"\r\n\r\n", 1)
+        self.assertIn(f"Content-Length: {len(expected)}".encode(), head)
+        self.assertIn(b"Connection: close", head)
+        self.assertEqual(body, expected)
+
+    @staticmethod
+    def read_all(sock) -> bytes:
+        """ Все данные до закрытия соединения сервером """
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def test_keep_alive(self):
+        """ Несколько запросов по одному соединению HTTP/1.1 """
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        for path in ("/httptest/dir2/page.html", "/httptest/absent.html", "/index.html"):
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.getheader("Connection"), "keep-alive")
+        self.assertEqual(response.status, httpd.OK)
+        conn.close()
+
+    def test_pipelining(self):
+        """ Запросы, отправленные подряд без ожидания ответов, получают ответы по порядку """
+        paths = ["httptest/text..txt", "httptest/dir2/page.html", "httptest/absent.html",
+                 "httptest/dir1/dir12/dir123/deep.txt"]
+        requests = b"".join(f"GET /{path} HTTP/1.1\r\nHost: test\r\n\r\n".encode()
+                            for path in paths)
+        requests += b"HEAD /index.html HTTP/1.1\r\nConnection: close\r\n\r\n"
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(requests)
+            data = self.read_all(sock)
+        for path in paths:
+            head, data = data.split(b"\r\n\r\n", 1)
+            length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            body, data = data[:length], data[length:]
+            if b" 200 " in head.split(b"\r\n")[0]:
+                with open(os.path.join(DOCUMENT_ROOT, path), "rb") as f:
+                    self.assertEqual(body, f.read(), path)
+            else:
+                self.assertIn(b"404", head, path)
+        self.assertTrue(data.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"Connection: close", data)
+
+    def test_oversized_body(self):
+        """ Тело больше maxsize не читается: ответ 413 закрывает соединение,
+        и запрос внутри тела не разбирается как следующий """
+        request = (b"POST /index.html HTTP/1.1\r\nContent-Length: %d\r\n\r\n"
+                   b"GET /index.html HTTP/1.1\r\n\r\n" % (httpd.HTTPServer.maxsize + 1))
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(request)
+            data = self.read_all(sock)
+        self.assertTrue(data.startswith(b"HTTP/1.1 413 "))
+        self.assertIn(b"Connection: close", data)
+        self.assertEqual(data.count(b"HTTP/1.1 "), 1)
+
+    def test_oversized_headers(self):
+        """ Заголовки больше maxsize без конца получают 431 и закрытие соединения """
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            head = b"GET / HTTP/1.1\r\nX-Long: "
+            # на байт больше maxsize: сервер читает все, и закрытие не дает RST
+            sock.sendall(head + b"a" * (httpd.HTTPServer.maxsize + 1 - len(head)))
+            data = self.read_all(sock)
+        self.assertTrue(data.startswith(b"HTTP/1.1 431 "))
+        self.assertEqual(data.count(b"HTTP/1.1 "), 1)
+
+    def test_http10_closes(self):
+        """ HTTP/1.0 без Connection: keep-alive - соединение закрывается после ответа """
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(b"GET /index.html HTTP/1.0\r\n\r\n")
+            data = self.read_all(sock)
+        self.assertIn(b"Connection: close", data)
+
+    def test_max_requests(self):
+        """ После max_requests запросов сервер закрывает соединение """
+        requests = b"GET /index.html HTTP/1.1\r\n\r\n" * self.server.max_requests
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(requests)
+            data = self.read_all(sock)
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), self.server.max_requests)
+        self.assertEqual(data.count(b"Connection: close"), 1)
+        self.assertEqual(data.rfind(b"Connection: close"), data.rfind(b"Connection: "))
+
+    def test_conditional(self):
+        """ Повторный запрос с If-None-Match или If-Modified-Since - 304 без тела """
+        response, _ = self.request("GET", "/httptest/splash.css")
+        etag, modified = response.getheader("ETag"), response.getheader("Last-Modified")
+        self.assertTrue(etag.startswith('"'))
+        for headers in ({"If-None-Match": etag}, {"If-None-Match": f'"x", W/{etag}'},
+                        {"If-Modified-Since": modified}):
+            response, body = self.request("GET", "/httptest/splash.css", headers)
+            self.assertEqual(response.status, httpd.NOT_MODIFIED, headers)
+            self.assertEqual(body, b"")
+            self.assertEqual(response.getheader("ETag"), etag)
+        for headers in ({"If-None-Match": '"other"', "If-Modified-Since": modified},
+                        {"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"},
+                        {"If-Modified-Since": "not a date"}):
+            response, _ = self.request("GET", "/httptest/splash.css", headers)
+            self.assertEqual(response.status, httpd.OK, headers)
+
+    def test_range(self):
+        """ Один диапазон - 206 с Content-Range, из кэша и через sendfile """
+        for path, header, expected in (("httptest/jquery-1.9.1.js", "bytes=100-199", (100, 199)),
+                                       ("httptest/splash.css", "bytes=-50", (-50, None)),
+                                       ("httptest/splash.css", "bytes=10-", (10, None))):
+            with open(os.path.join(DOCUMENT_ROOT, path), "rb") as f:
+                data = f.read()
+            start, end = expected
+            part = data[start:end + 1 if end is not None else None]
+            response, body = self.request("GET", "/" + path, {"Range": header})
+            self.assertEqual(response.status, httpd.PARTIAL_CONTENT, header)
+            self.assertEqual(body, part, header)
+            first = start % len(data)
+            self.assertEqual(response.getheader("Content-Range"),
+                             f"bytes {first}-{first + len(part) - 1}/{len(data)}")
+            self.assertEqual(response.getheader("Accept-Ranges"), "bytes")
+
+    def test_multiple_ranges(self):
+        """ Несколько диапазонов - multipart/byteranges """
+        for path in ("httptest/jquery-1.9.1.js", "httptest/splash.css"):
+            with open(os.path.join(DOCUMENT_ROOT, path), "rb") as f:
+                data = f.read()
+            response, body = self.request("GET", "/" + path, {"Range": "bytes=0-9,500-599"})
+            self.assertEqual(response.status, httpd.PARTIAL_CONTENT)
+            content_type = response.getheader("Content-Type")
+            self.assertTrue(content_type.startswith("multipart/byteranges; boundary="))
+            boundary = content_type.split("boundary=")[1].encode()
+            parts = body.split(b"--" + boundary)
+            self.assertEqual(parts[-1], b"--\r\n")
+            self.assertEqual(len(parts), 4)
+            self.assertIn(b"Content-Range: bytes 0-9/%d" % len(data), parts[1])
+            self.assertEqual(parts[1].split(b"\r\n\r\n", 1)[1], data[:10] + b"\r\n")
+            self.assertEqual(parts[2].split(b"\r\n\r\n", 1)[1], data[500:600] + b"\r\n")
+
+    def test_range_not_satisfiable(self):
+        """ Диапазон за концом файла - 416, некорректный Range и устаревший If-Range
+        - файл целиком """
+        size = os.path.getsize(os.path.join(DOCUMENT_ROOT, "httptest/splash.css"))
+        response, _ = self.request("GET", "/httptest/splash.css", {"Range": f"bytes={size}-"})
+        self.assertEqual(response.status, httpd.RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response.getheader("Content-Range"), f"bytes */{size}")
+        for headers in ({"Range": "bytes=z-1"},
+                        {"Range": "bytes=0-9", "If-Range": '"stale"'}):
+            response, body = self.request("GET", "/httptest/splash.css", headers)
+            self.assertEqual(response.status, httpd.OK, headers)
+            self.assertEqual(len(body), size)
+
+    def test_gzip(self):
+        """ Текстовый файл сжимается по Accept-Encoding, картинка - нет """
+        with open(os.path.join(DOCUMENT_ROOT, "httptest/splash.css"), "rb") as f:
+            expected = f.read()
+        headers = {"Accept-Encoding": "gzip"}
+        response, body = self.request("GET", "/httptest/splash.css", headers)
+        self.assertEqual(response.getheader("Content-Encoding"), "gzip")
+        self.assertEqual(response.getheader("Vary"), "Accept-Encoding")
+        self.assertEqual(response.getheader("Content-Type"), "text/css")
+        self.assertEqual(gzip.decompress(body), expected)
+        response, body = self.request("GET", "/httptest/splash.css")
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertEqual(body, expected)
+        response, _ = self.request("GET", "/httptest/logo.v2.png", headers)
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertIsNone(response.getheader("Vary"))
+
+    def test_escaping_forbidden(self):
+        """ Путь за пределы корневой директории - 403 """
+        response, _ = self.request("GET", "/httptest/../../../../../../../../etc/passwd")
+        self.assertEqual(response.status, httpd.FORBIDDEN)
+
+    def test_null_byte(self):
+        """ NUL в пути - 400, воркер продолжает обслуживать запросы """
+        for _ in range(self.workers + 1):
+            response, _ = self.request("GET", "/httptest/%00")
+            self.assertEqual(response.status, httpd.BAD_REQUEST)
+        response, _ = self.request("GET", "/httptest/dir2/page.html")
+        self.assertEqual(response.status, httpd.OK)
+
+    def test_unexpected_error(self):
+        """ Непредвиденная ошибка обработки дает 500 или закрывает только свое
+        соединение, воркеры продолжают обслуживать запросы """
+        if self.mode == "prefork":
+            self.skipTest("patch is not visible in worker processes")
+        with mock.patch.object(self.server, "analyze_request", side_effect=RuntimeError):
+            for _ in range(self.workers + 1):
+                response, _ = self.request("GET", "/httptest/dir2/page.html")
+                self.assertEqual(response.status, httpd.INTERNAL_SERVER_ERROR)
+                self.assertEqual(response.getheader("Connection"), "close")
+        with mock.patch.object(self.server, "respond", side_effect=RuntimeError):
+            for _ in range(self.workers + 1):
+                with self.assertRaises((http.client.RemoteDisconnected, ConnectionError)):
+                    self.request("GET", "/httptest/dir2/page.html")
+        response, _ = self.request("GET", "/httptest/dir2/page.html")
+        self.assertEqual(response.status, httpd.OK)
+
+    def test_concurrent_requests(self):
+        """ Параллельные запросы разных файлов не смешивают ответы между собой """
+        paths = ["httptest/dir2/page.html", "httptest/splash.css", "httptest/text..txt",
+                 "httptest/space in name.txt", "httptest/dir1/dir12/dir123/deep.txt",
+                 "index.html"]
+        expected = {}
+        for path in paths:
+            with open(os.path.join(DOCUMENT_ROOT, path), "rb") as f:
+                expected[path] = f.read()
+
+        def fetch(i):
+            path = paths[i % len(paths)]
+            response, body = self.request("GET", "/" + quote(path))
+            return path, response.status, body
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(fetch, range(300)))
+        for path, status, body in results:
+            self.assertEqual(status, httpd.OK, path)
+            self.assertEqual(body, expected[path], path)
+
+
+class EpollHttpdTestCase(HttpdTestCase):
+    """ Те же проверки для режима цикла событий """
+    mode = "epoll"
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "prefork mode needs os.fork")
+class PreforkHttpdTestCase(HttpdTestCase):
+    """ Те же проверки для режима процессов-воркеров """
+    mode = "prefork"
+
+    def test_restart_worker(self):
+        """ Упавший процесс-воркер перезапускается, сервер продолжает отвечать """
+        pid = next(iter(self.server.processes))
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 5
+        while (pid in self.server.processes or len(self.server.processes) < self.workers) \
+                and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertNotIn(pid, self.server.processes)
+        self.assertEqual(len(self.server.processes), self.workers)
+        for _ in range(10):
+            response, _ = self.request("GET", "/httptest/dir2/page.html")
+            self.assertEqual(response.status, httpd.OK)
+
+
+class HeadersTestCase(unittest.TestCase):
+    """ Тесты сборки заголовков ответа """
+
+    def test_date_cached(self):
+        """ Дата форматируется раз в секунду, в пределах секунды - те же байты """
+        date = HttpDate()
+        with mock.patch("headers.time.time", side_effect=[1000.2, 1000.7, 1001.1]):
+            first = date.get()
+            self.assertIs(date.get(), first)
+            self.assertNotEqual(date.get(), first)
+        self.assertEqual(first, b"Thu, 01 Jan 1970 00:16:40 GMT")
+
+    def test_error_headers(self):
+        """ Страница ошибки с верной длиной и закрытием соединения """
+        server = httpd.HTTPServer("127.0.0.1", 0, 1, threading.Event(), DOCUMENT_ROOT)
+        request = httpd.Request()
+        response = server.get_response(b"\n", request)
+        head, body = response.split(b"\r\n\r\n", 1)
+        self.assertTrue(head.startswith(b"HTTP/1.1 400 BAD_REQUEST\r\n"))
+        self.assertIn(b"Content-Length: %d\r\n" % len(body), head + b"\r\n")
+        self.assertIn(b"Connection: close", head)
+
+    def test_validators_without_cache(self):
+        """ ETag и Cache-Control для файла, отдаваемого через sendfile мимо кэша """
+        server = httpd.HTTPServer("127.0.0.1", 0, 1, threading.Event(), DOCUMENT_ROOT)
+        server.file_cache = httpd.FileCache(max_bytes=0)
+        server.cache_control = b"Cache-Control: max-age=60\r\n"
+        request = httpd.Request()
+        head = server.get_response(b"GET /index.html HTTP/1.1\r\n\r\n", request)
+        request.file.close()
+        st = os.stat(os.path.join(DOCUMENT_ROOT, "index.html"))
+        self.assertIn(b"ETag: " + httpd.make_etag(st), head)
+        self.assertIn(b"Cache-Control: max-age=60\r\n", head)
+        request = httpd.Request()
+        data = b"GET /index.html HTTP/1.1\r\nIf-None-Match: " + httpd.make_etag(st) + b"\r\n\r\n"
+        head = server.get_response(data, request)
+        self.assertTrue(head.startswith(b"HTTP/1.1 304 "))
+        self.assertIsNone(request.file)
+        self.assertNotIn(b"Content-Length", head)
+
+
+class CompressionTestCase(unittest.TestCase):
+    """ Тесты выбора кодировки и сжатых вариантов файлов """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.server = httpd.HTTPServer("127.0.0.1", 0, 1, threading.Event(), self.tmpdir.name)
+        self.text = b"<p>compressible text</p>\n" * 200
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, data: bytes) -> str:
+        """ Файл во временной директории """
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def get(self, path: str, headers=b"") -> tuple:
+        """ Заголовки и тело ответа без сети """
+        request = httpd.Request()
+        head = self.server.get_response(b"GET %s HTTP/1.1\r\n%s\r\n" % (path, headers), request)
+        if request.file is not None:
+            with request.file:
+                return head, request.file.read()
+        return head, request.response_body
+
+    def test_negotiate(self):
+        """ Кодировки по убыванию q, q=0 и отсутствующие в списке не выбираются """
+        available = ("br", "gzip")
+        self.assertEqual(compression.negotiate(b"gzip, deflate, br", available), ["br", "gzip"])
+        self.assertEqual(compression.negotiate(b"br;q=0.5, gzip", available), ["gzip", "br"])
+        self.assertEqual(compression.negotiate(b"gzip;q=0, *", available), ["br"])
+        self.assertEqual(compression.negotiate(b"identity", available), [])
+
+    def test_precompressed_sibling(self):
+        """ Готовый page.html.gz отдается вместо сжатия на лету, в том числе через
+        sendfile, если кэш выключен. Устаревший готовый файл не используется """
+        self.write("page.html", self.text)
+        sibling = self.write("page.html.gz", b"precompressed")
+        for cache in (httpd.FileCache(), httpd.FileCache(max_bytes=0)):
+            self.server.file_cache = cache
+            head, body = self.get(b"/page.html", b"Accept-Encoding: gzip\r\n")
+            self.assertIn(b"Content-Encoding: gzip\r\n", head)
+            self.assertIn(b"Content-Type: text/html\r\n", head)
+            self.assertIn(b"Content-Length: 13\r\n", head)
+            self.assertEqual(body, b"precompressed")
+        os.utime(sibling, ns=(0, 0))
+        self.server.file_cache = httpd.FileCache()
+        head, body = self.get(b"/page.html", b"Accept-Encoding: gzip\r\n")
+        self.assertEqual(gzip.decompress(body), self.text)
+
+    def test_compressed_cache(self):
+        """ Сжатый на лету вариант хранится в кэше со своим ETag """
+        self.write("page.html", self.text)
+        head, body = self.get(b"/page.html", b"Accept-Encoding: gzip\r\n")
+        cached = self.server.file_cache.get(f"{self.server.root}/page.html\0gzip")
+        self.assertIs(cached.data, body)
+        self.assertIn(b"ETag: " + cached.etag, head)
+        self.assertTrue(cached.etag.endswith(b'-gzip"'))
+        head, _ = self.get(b"/page.html", b"Accept-Encoding: gzip\r\nIf-None-Match: " +
+                           cached.etag + b"\r\n")
+        self.assertTrue(head.startswith(b"HTTP/1.1 304 "))
+        self.assertIn(b"Content-Encoding: gzip\r\n", head)
+
+    def test_not_compressed(self):
+        """ Файлы меньше порога, запросы части файла и сервер с выключенным
+        сжатием отдают исходные байты """
+        self.write("small.html", b"<p>small</p>" * 10)
+        self.write("page.html", self.text)
+        head, _ = self.get(b"/small.html", b"Accept-Encoding: gzip\r\n")
+        self.assertNotIn(b"Content-Encoding", head)
+        self.assertIn(b"Vary: Accept-Encoding\r\n", head)
+        head, body = self.get(b"/page.html", b"Accept-Encoding: gzip\r\nRange: bytes=0-9\r\n")
+        self.assertNotIn(b"Content-Encoding", head)
+        self.assertEqual(body, self.text[:10])
+        self.server.compress = False
+        head, body = self.get(b"/page.html", b"Accept-Encoding: gzip\r\n")
+        self.assertNotIn(b"Content-Encoding", head)
+        self.assertEqual(body, self.text)
+
+    def test_precompress(self):
+        """ Утилита сжимает текстовые файлы не меньше min_size и пропускает
+        файлы, у которых готовый вариант новее """
+        self.write("page.html", self.text)
+        self.write("small.css", b"p {}")
+        self.write("image.png", os.urandom(2048))
+        count, before, after = compression.precompress(self.tmpdir.name, encodings=["gzip"])
+        self.assertEqual((count, before), (1, len(self.text)))
+        with open(os.path.join(self.tmpdir.name, "page.html.gz"), "rb") as f:
+            data = f.read()
+        self.assertEqual(len(data), after)
+        self.assertEqual(gzip.decompress(data), self.text)
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)),
+                         ["image.png", "page.html", "page.html.gz", "small.css"])
+        self.assertEqual(compression.precompress(self.tmpdir.name, encodings=["gzip"]), (0, 0, 0))
+
+
+class FileCacheTestCase(unittest.TestCase):
+    """ Тесты кэша файлов """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, data: bytes) -> str:
+        """ Файл во временной директории """
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_lru_by_bytes(self):
+        """ При превышении общего размера вытесняются давно не запрошенные файлы,
+        файлы больше max_file не кэшируются """
+        cache = httpd.FileCache(max_bytes=25, max_file=20)
+        for name in ("a.txt", "b.txt", "c.txt"):
+            cache.load(name, self.write(name, b"x" * 10))
+            cache.get("a.txt")
+        self.assertIsNotNone(cache.get("a.txt"))
+        self.assertIsNone(cache.get("b.txt"))
+        self.assertEqual(cache.get("c.txt").data, b"x" * 10)
+        self.assertEqual(cache.size, 20)
+        self.assertIsNone(cache.load("big.txt", self.write("big.txt", b"x" * 21)))
+
+    def test_revalidate(self):
+        """ Измененный файл перечитывается после check_interval """
+        path = self.write("page.html", b"old")
+        cache = httpd.FileCache(check_interval=0)
+        self.assertEqual(cache.load(path, path).mime, "text/html")
+        self.assertIsNotNone(cache.get(path))
+        self.write("page.html", b"newer")
+        self.assertIsNone(cache.get(path))
+        self.assertEqual(cache.size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()